@@ -1,46 +1,73 @@
 import pandas as pd
 import os
+import argparse
 from glob import glob
-from tqdm import tqdm
+from excel_ingest import append_all_sheets
+from output_writers import TableWriter
+from parse_cache import ParseCache
+import telemetry
 
 # Path to the directory containing the Excel files
 directory_path = r'C:\Users\habim\Desktop\Non_Listed_CIQ\Append'
 output_path = r'C:\Users\habim\Desktop\Non_Listed_CIQ\Append'
 
-# Ensure the output directory exists
-os.makedirs(output_path, exist_ok=True)
-
-# Get all Excel files in the directory, ignoring temporary files
-excel_files = [file for file in glob(os.path.join(directory_path, '*.xlsx')) if not os.path.basename(file).startswith('~$')]
-
 # Function to remove unnamed columns
 def remove_unnamed_columns(df):
     return df.loc[:, ~df.columns.str.contains('^Unnamed')]
 
-# Function to read and append sheets with the same name
-def append_sheets(sheet_name, files):
-    appended_data = pd.DataFrame()
-    for file in tqdm(files, desc=f'Appending {sheet_name}'):
-        xls = pd.ExcelFile(file)
-        if sheet_name in xls.sheet_names:
-            df = xls.parse(sheet_name)
-            df = remove_unnamed_columns(df)  # Remove unnamed columns
-            df['Company Name'] = os.path.basename(file).split('_')[1]
-            if 'Filing Date' in df.columns:
-                df['Filing Date'] = pd.to_datetime(df['Filing Date'], errors='coerce').dt.year  # Extract only the year, handle errors
-            appended_data = pd.concat([appended_data, df], ignore_index=True)
-    return appended_data
-
-# Appending each sheet separately
-first_file = pd.ExcelFile(excel_files[0])
-sheets = first_file.sheet_names
-appended_data_dict = {sheet: append_sheets(sheet, excel_files) for sheet in sheets}
-
-# Save each appended sheet to the output directory
-output_file_path = os.path.join(output_path, 'Appended_SheetsAll.xlsx')
-with pd.ExcelWriter(output_file_path) as writer:
+# Function to clean one parsed sheet before it is appended (runs inside the worker with --workers)
+def prepare_sheet(df, file):
+    df = remove_unnamed_columns(df)  # Remove unnamed columns
+    df['Company Name'] = os.path.basename(file).split('_')[1]
+    if 'Filing Date' in df.columns:
+        df['Filing Date'] = pd.to_datetime(df['Filing Date'], errors='coerce').dt.year  # Extract only the year, handle errors
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description='Append all Capital IQ sheets into one workbook.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to parse the workbooks')
+    parser.add_argument('--cache-dir', default=None, help='Keep parsed sheets here and only re-parse new or changed workbooks')
+    parser.add_argument('--format', choices=['xlsx', 'csv', 'parquet'], default='xlsx',
+                        help='Output format: one workbook with a sheet per name, or one CSV / Parquet file per sheet name')
+    telemetry.add_arguments(parser, os.path.join(output_path, 'telemetry.jsonl'))
+    args = parser.parse_args()
+
+    # Per-stage wall / CPU time, peak memory and rows go to --telemetry as JSON lines
+    tel = telemetry.from_args(args, 'Append All CIQ Data.py')
+
+    # Ensure the output directory exists
+    os.makedirs(output_path, exist_ok=True)
+
+    # Get all Excel files in the directory, ignoring temporary files
+    excel_files = [file for file in glob(os.path.join(directory_path, '*.xlsx')) if not os.path.basename(file).startswith('~$')]
+
+    cache = ParseCache(args.cache_dir) if args.cache_dir else None
+
+    # Appending every sheet found in any file, opening each workbook only once
+    with tel.stage('ingest') as st:
+        appended_data_dict = append_all_sheets(excel_files, transform=prepare_sheet, workers=args.workers, cache=cache,
+                                               progress=lambda files: tel.progress(files, 'ingest', 'Appending sheets'))
+        st['rows'], st['bytes'] = sum(len(df) for df in appended_data_dict.values()), telemetry.file_bytes(excel_files)
+    if cache is not None:
+        print(cache.summary())
+
+    # Save each appended sheet to the output directory; sheets past Excel's row limit
+    # continue on "<sheet>_2", ... (listed in Appended_SheetsAll_manifest.csv)
+    output_file_path = os.path.join(output_path, f'Appended_SheetsAll.{args.format}')
+    writer = TableWriter(output_file_path)
     for sheet, data in appended_data_dict.items():
-        data.to_excel(writer, sheet_name=sheet, index=False)
+        with tel.stage('write', sheet=sheet) as st:
+            writer.write(data, sheet)
+            st['rows'] = len(data)
+    with tel.stage('write') as st:
+        manifest = writer.close()
+        st['rows'], st['bytes'] = sum(p['rows'] for p in manifest), telemetry.file_bytes(writer.files())
+    tel.close()
 
-print(f"Data appending complete. File saved as '{output_file_path}'")
+    if args.format == 'xlsx':
+        print(f"Data appending complete. File saved as '{output_file_path}'")
+    else:
+        print(f"Data appending complete. Files saved as '{os.path.splitext(output_file_path)[0]}_<sheet>.{args.format}'")
 
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,19 @@
-
-
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
 import pandas as pd
 from typing import List
 
+from compact_dtypes import compact_frame
+from lseg_panel import HeaderCache, LayoutError, balanced_panel, join_metrics, read_wide_sheet
+from output_writers import write_table
+
 # ========= USER SETTINGS =========
 BASE_DIR = r"C:\Users\habim\OneDrive - Hanken Svenska handelshogskolan\Desktop\LSEG Workspace\Western Asia"  # folder that CONTAINS Central Asia.xlsx
 INPUT_FILE = "Western Asia.xlsx"
 SHEET_NAME = "Western Asia"
-OUTPUT_FILE = "Western Asia_Panel.xlsx"
+OUTPUT_FILE = "Western Asia_Panel.xlsx"  # .xlsx, .csv, .parquet or .dta
 
 # Name of the metric in this sheet (rename if you like)
 METRIC_NAME = "Value"
@@ -16,158 +21,170 @@ METRIC_NAME = "Value"
 # Year span enforced for every ISIN
 YEAR_MIN, YEAR_MAX = 2000, 2024
 YEARS_ALL = list(range(YEAR_MIN, YEAR_MAX + 1))
-# =================================
 
-def clean_col_label(x) -> str:
-    if x is None or (isinstance(x, float) and pd.isna(x)):
-        return ""
-    return " ".join(str(x).replace("\n", " ").strip().split())
+# ISINs on more than one row: 'first', 'last' or 'mean' combines them, 'raise' stops the run
+DUPLICATES = "first"
 
-def is_int_year(x) -> bool:
-    try:
-        y = int(str(x).strip())
-        return YEAR_MIN <= y <= YEAR_MAX
-    except Exception:
-        return False
+# Written for missing values in .xlsx / .csv outputs ("" leaves the cell empty);
+# .dta files get Stata missing and .parquet files nulls
+MISSING_VALUE = "."
 
-def main():
-    input_path = os.path.join(BASE_DIR, INPUT_FILE)
-    if not os.path.exists(input_path):
-        raise FileNotFoundError(f"Could not find: {input_path}")
+# Batch mode (--batch ROOT): one wide panel with a column per metric, written under ROOT
+BATCH_OUTPUT_FILE = "All Regions_Panel.xlsx"
 
-    # File layout:
-    # row 0: metadata headers + "year" repeated for time-series columns
-    # row 1: mostly blank
-    # row 2: actual years under those "year" columns (2000..2024)
-    # data from row 3 downward
-    raw = pd.read_excel(input_path, sheet_name=SHEET_NAME, header=None)
-
-    if raw.shape[0] < 4:
-        raise ValueError("The sheet looks too short; expected at least 4 rows (3 header rows + data).")
-
-    header_row0 = raw.iloc[0].tolist()
-    header_row2 = raw.iloc[2].tolist()
-
-    # Year columns: where top header == 'year' and row-2 has a valid year in range
-    year_col_idx: List[int] = []
-    year_labels: List[int] = []
-    for j, top in enumerate(header_row0):
-        if isinstance(top, str) and top.strip().lower() == "year":
-            yr = header_row2[j]
-            if is_int_year(yr):
-                year_col_idx.append(j)
-                year_labels.append(int(str(yr).strip()))
-
-    if not year_col_idx:
-        raise ValueError("No valid year columns (2000–2024) were found. Check the header layout.")
-
-    # Metadata columns: anything not 'year' (non-empty)
-    meta_cols_idx: List[int] = []
-    meta_names: List[str] = []
-    for j, top in enumerate(header_row0):
-        if not (isinstance(top, str) and top.strip().lower() == "year"):
-            name = clean_col_label(top)
-            if name:
-                meta_cols_idx.append(j)
-                meta_names.append(name)
-
-    # Slice data rows
-    data = raw.iloc[3:].reset_index(drop=True).copy()
-    keep_idx = meta_cols_idx + year_col_idx
-    data = data.iloc[:, keep_idx].copy()
-
-    # Rename columns: metadata names + integer years
-    rename_map = {}
-    for i, _j in enumerate(meta_cols_idx):
-        rename_map[data.columns[i]] = meta_names[i]
-    for k, _j in enumerate(year_col_idx):
-        pos = len(meta_cols_idx) + k
-        rename_map[data.columns[pos]] = int(year_labels[k])
-    data = data.rename(columns=rename_map)
+# Detected headers are kept here (next to the workbooks) and reused while a workbook is unchanged
+HEADER_CACHE_FILE = ".header_cache.json"
+# =================================
+
+# Order columns nicely: ISIN, Year, key metadata, then values
+PREFERRED_META = [
+    "Identifier",
+    "Company Name",
+    "Country of Headquarters",
+    "RIC",
+    "TRBC Industry Name",
+]
+
+def sheet_panel(input_path: str, sheet_name: str, metric_name: str, header=None):
+    """Balanced ISIN-Year panel of one sheet (values as floats); returns (panel, ISIN column, metadata columns, header)."""
+    # Header rows are parsed once per sheet (or taken from the cache), then the data rows are
+    # streamed read-only and only the metadata and year columns are kept (year values as floats)
+    data, header = read_wide_sheet(input_path, sheet_name, YEAR_MIN, YEAR_MAX, header)
 
     # Find ISIN column (case-insensitive exact)
     isin_candidates = [c for c in data.columns if str(c).strip().lower() == "isin"]
     if not isin_candidates:
-        raise KeyError(f"Could not find an 'ISIN' column among: {list(data.columns)}")
+        raise LayoutError(f"Could not find an 'ISIN' column among: {list(data.columns)}")
     ISIN_COL = isin_candidates[0]
 
     # Keep only rows with an ISIN
-    data = data[data[ISIN_COL].notna()].copy()
+    data = data[data[ISIN_COL].notna()]
 
     # Trim string metadata
-    for col in meta_names:
+    for col in header["meta_names"]:
         if col in data.columns and pd.api.types.is_string_dtype(data[col]):
             data[col] = data[col].astype("string").str.strip()
 
-    # Coerce year columns to numeric (they may contain text)
-    year_cols = [c for c in data.columns if isinstance(c, int) and YEAR_MIN <= c <= YEAR_MAX]
-    for yc in year_cols:
-        data[yc] = pd.to_numeric(data[yc], errors="coerce")
-
-    # Long format
-    id_vars = [col for col in meta_names if col in data.columns]  # existing metadata cols
-    long = data.melt(id_vars=id_vars, value_vars=year_cols, var_name="Year", value_name=METRIC_NAME)
-
-    # Ensure Year is Int64
-    long["Year"] = pd.to_numeric(long["Year"], errors="coerce").astype("Int64")
-
-    # ---- ENSURE FULL ISIN x YEAR GRID (2000..2024) ----
-    # List of unique ISINs
-    isins = (
-        long[ISIN_COL]
-        .dropna()
-        .astype("string")
-        .str.strip()
-        .unique()
-        .tolist()
-    )
-
-    # Build complete grid
-    grid = pd.MultiIndex.from_product([isins, YEARS_ALL], names=[ISIN_COL, "Year"]).to_frame(index=False)
-
-    # Keep one row of metadata per ISIN to re-attach (first non-null per ISIN)
+    # ---- BALANCED ISIN x YEAR PANEL (2000..2024) ----
+    # Built straight from the values matrix: every ISIN gets one row per year in YEARS_ALL,
+    # metadata (first non-null per ISIN) is repeated onto its rows
     # IMPORTANT: exclude ISIN from the metadata set to avoid duplicate column names
-    meta_cols_present = [c for c in id_vars if c in long.columns and c != ISIN_COL]
-    meta_first = (
-        long[[ISIN_COL] + meta_cols_present]
-        .drop_duplicates(subset=[ISIN_COL])
-        .groupby(ISIN_COL, as_index=False)
-        .first()
-    )
-
-    # Merge values onto grid
-    values_only = long[[ISIN_COL, "Year", METRIC_NAME]].copy()
-    panel = grid.merge(values_only, on=[ISIN_COL, "Year"], how="left")
-
-    # Attach metadata
-    panel = panel.merge(meta_first, on=ISIN_COL, how="left")
-
-    # ---- REPLACE missing / non-numeric with "." ----
-    panel[METRIC_NAME] = pd.to_numeric(panel[METRIC_NAME], errors="coerce")
-    panel[METRIC_NAME] = panel[METRIC_NAME].astype(object).where(panel[METRIC_NAME].notna(), ".")
-
-    # Order columns nicely: ISIN, Year, key metadata, then value
-    preferred_meta = [
-        "Identifier",
-        "Company Name",
-        "Country of Headquarters",
-        "RIC",
-        "TRBC Industry Name",
-    ]
-    ordered_meta = [c for c in preferred_meta if c in panel.columns]
-    extra_meta = [c for c in meta_cols_present if c not in ordered_meta]
-
-    panel = panel[[ISIN_COL, "Year"] + ordered_meta + extra_meta + [METRIC_NAME]]
-
-    # Sort for readability
-    panel = panel.sort_values([ISIN_COL, "Year"]).reset_index(drop=True)
+    year_cols = [c for c in data.columns if isinstance(c, int) and YEAR_MIN <= c <= YEAR_MAX]
+    meta_cols_present: List[str] = [c for c in header["meta_names"] if c != ISIN_COL]
+    panel = balanced_panel(data, ISIN_COL, meta_cols_present, year_cols, YEARS_ALL,
+                           value_name=metric_name, duplicates=DUPLICATES)
+    return panel, ISIN_COL, meta_cols_present, header
+
+def finish_panel(panel: pd.DataFrame, isin_col: str, meta_cols: List[str], value_cols: List[str]) -> pd.DataFrame:
+    # Metadata repeats on every year row: store it as categoricals, Year as int16.
+    # Values stay floats with NaN; MISSING_VALUE is only applied by the writer
+    panel = compact_frame(panel, categorical=[isin_col] + meta_cols, label="ISIN-Year panel")
+
+    ordered_meta = [c for c in PREFERRED_META if c in panel.columns]
+    extra_meta = [c for c in meta_cols if c not in ordered_meta]
+    return panel[[isin_col, "Year"] + ordered_meta + extra_meta + value_cols]
+
+def run_single():
+    input_path = os.path.join(BASE_DIR, INPUT_FILE)
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Could not find: {input_path}")
+
+    cache = HeaderCache(os.path.join(BASE_DIR, HEADER_CACHE_FILE), YEAR_MIN, YEAR_MAX)
+    panel, isin_col, meta_cols, header = sheet_panel(input_path, SHEET_NAME, METRIC_NAME,
+                                                     cache.get(input_path, SHEET_NAME))
+    cache.put(input_path, SHEET_NAME, header)
+    cache.save()
+    panel = finish_panel(panel, isin_col, meta_cols, [METRIC_NAME])
 
     # Write output
     out_path = os.path.join(BASE_DIR, OUTPUT_FILE)
-    panel.to_excel(out_path, index=False)
+    write_table(panel, out_path, na_rep=MISSING_VALUE, na_cols=[METRIC_NAME])
     print(f"Panel (ISIN-Year) written to:\n{out_path}")
     print(f"Rows: {len(panel):,} | Cols: {len(panel.columns):,}")
     print(f"Years enforced: {YEAR_MIN}–{YEAR_MAX}")
 
+def discover_sheets(root: str):
+    """
+    Every (workbook, sheet) under root, with its region and metric:
+      - region = workbook name (e.g. "Western Asia");
+      - metric = sheet name, or, when the sheet is named after the region, the workbook's
+        folder under root (e.g. ROOT/Total Assets/Western Asia.xlsx), else METRIC_NAME.
+    Temporary (~$) files and earlier *_Panel.xlsx outputs are skipped.
+    """
+    tasks = []
+    for path in sorted(glob(os.path.join(root, "**", "*.xlsx"), recursive=True)):
+        name = os.path.basename(path)
+        if name.startswith("~$") or name.endswith("_Panel.xlsx"):
+            continue
+        region = os.path.splitext(name)[0]
+        folder = os.path.relpath(os.path.dirname(path), root)
+        with pd.ExcelFile(path) as xls:
+            sheets = xls.sheet_names
+        for sheet in sheets:
+            if sheet.strip().lower() != region.strip().lower():
+                metric = sheet
+            else:
+                metric = folder if folder != "." else METRIC_NAME
+            tasks.append((path, sheet, region, metric))
+    return tasks
+
+# Function run in a worker process: convert one sheet, or report why its layout was skipped;
+# other errors (e.g. duplicate ISINs with DUPLICATES = "raise") stop the run
+def convert_sheet(task, header):
+    path, sheet, region, metric = task
+    try:
+        panel, isin_col, meta_cols, header = sheet_panel(path, sheet, metric, header)
+    except LayoutError as e:
+        return task, None, None, None, str(e)
+    panel = panel.rename(columns={isin_col: "ISIN"})
+    panel["Region"] = pd.Categorical.from_codes([0] * len(panel), [region])
+    return task, header, panel, meta_cols + ["Region"], None
+
+def run_batch(root: str, workers: int):
+    tasks = discover_sheets(root)
+    if not tasks:
+        raise FileNotFoundError(f"No workbooks found under: {root}")
+    print(f"Converting {len(tasks)} sheets from {len({t[0] for t in tasks})} workbooks with {workers} worker(s)")
+
+    cache = HeaderCache(os.path.join(root, HEADER_CACHE_FILE), YEAR_MIN, YEAR_MAX)
+    headers = [cache.get(path, sheet) for path, sheet, _, _ in tasks]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(convert_sheet, tasks, headers))
+    else:
+        results = list(map(convert_sheet, tasks, headers))
+
+    panels = []
+    for (path, sheet, region, metric), header, panel, meta_cols, error in results:
+        if error:
+            print(f"Skipped {os.path.basename(path)} / {sheet}: {error}")
+            continue
+        cache.put(path, sheet, header)
+        panels.append((metric, panel, meta_cols))
+    cache.save()
+    if not panels:
+        raise ValueError("None of the sheets has the LSEG header layout.")
+
+    # ---- ONE WIDE ISIN x YEAR PANEL, ONE COLUMN PER METRIC ----
+    panel, meta_cols, metrics = join_metrics(panels, "ISIN", DUPLICATES)
+    panel = finish_panel(panel, "ISIN", meta_cols, metrics)
+
+    out_path = os.path.join(root, BATCH_OUTPUT_FILE)
+    write_table(panel, out_path, na_rep=MISSING_VALUE, na_cols=metrics)
+    print(f"Panel (ISIN-Year, {len(metrics)} metrics) written to:\n{out_path}")
+    print(f"Rows: {len(panel):,} | Cols: {len(panel.columns):,} | Metrics: {', '.join(metrics)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert LSEG wide sheets (years as columns) into ISIN-Year panels.")
+    parser.add_argument("--batch", metavar="ROOT", default=None,
+                        help="Convert every regional workbook and metric sheet under ROOT into one wide panel")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes converting sheets in batch mode")
+    args = parser.parse_args()
+
+    if args.batch:
+        run_batch(args.batch, args.workers)
+    else:
+        run_single()
+
 if __name__ == "__main__":
     main()
@@ -1,83 +1,110 @@
-import pandas as pd
 import os
+import argparse
 from glob import glob
-from tqdm import tqdm
-import time
+from compact_dtypes import compact_frame
+from excel_ingest import append_all_sheets, iter_workbooks
+from orbis_panel import (ID_VARS, DUPLICATE_POLICIES, clear_spill, iter_spilled_panels, parse_header_schema,
+                         spill_results, wide_to_panel)
+from parse_cache import ParseCache
+from stata_export import StataPartWriter
+import telemetry
 
 # Path to the directory containing the Excel files
 directory_path = r'C:\Users\s180020\Desktop\Orbis\Assets'
 
-# Get all Excel files in the directory
-excel_files = glob(os.path.join(directory_path, '*.xlsx'))
-
-# Function to read and append sheets with the same name
-def append_sheets(sheet_name, files):
-    appended_data = []
-    start_time = time.time()
-    
-    for i, file in enumerate(tqdm(files, desc=f'Processing sheet: {sheet_name}')):
-        xls = pd.ExcelFile(file)
-        if sheet_name in xls.sheet_names:
-            df = xls.parse(sheet_name)
-            appended_data.append(df)
-        
-        elapsed_time = time.time() - start_time
-        remaining_time = (elapsed_time / (i + 1)) * (len(files) - (i + 1))
-        print(f"Currently analyzing: {file}")
-        print(f"Estimated remaining time: {remaining_time:.2f} seconds")
-    
-    return pd.concat(appended_data, ignore_index=True)
-
-# Appending each sheet separately
-sheets = pd.ExcelFile(excel_files[0]).sheet_names
-appended_data_dict = {sheet: append_sheets(sheet, excel_files) for sheet in sheets}
-
-# Example sheet: 'Results'
-results_data = appended_data_dict['Results']
-results_data.to_csv('intermediate_results_data.csv', index=False)  # Save intermediate result to CSV
-del results_data  # Free up memory
-
-# Reload the intermediate results data to minimize memory usage
-results_data = pd.read_csv('intermediate_results_data.csv')
-
-# Transforming the 'Results' sheet into panel data
-def extract_year_variable_currency(column_name):
-    parts = column_name.split(' ')
-    year = parts[-1]
-    variable = ' '.join(parts[:-3]).replace('\n', ' ')
-    currency = parts[-2]
-    return variable, year, currency
-
-# Melt the DataFrame to long format
-melted_df = results_data.melt(id_vars=['Company name Latin alphabet', 'Country', 'Country ISO code'], 
-                              var_name='Variable_Year', value_name='Value')
-
-# Extract Variable, Year, and Currency from the 'Variable_Year' column
-melted_df[['Variable', 'Year', 'Currency']] = melted_df['Variable_Year'].str.extract(r'(.+)\n(.+)\s(.+)$')
-melted_df['Variable'] = melted_df['Variable'].str.replace('\n', ' ')
-melted_df['Unit'] = 'A Million'
-
-# Pivot the DataFrame to get variables as columns
-panel_data = melted_df.pivot_table(index=['Company name Latin alphabet', 'Country', 'Country ISO code', 'Year', 'Currency', 'Unit'], 
-                                   columns='Variable', values='Value').reset_index()
-
-# Rename columns
-panel_data = panel_data.rename(columns={'Company name Latin alphabet': 'Company Name'})
-
-# Function to split DataFrame into chunks
-def split_dataframe(df, chunk_size):
-    chunks = [df.iloc[i:i + chunk_size] for i in range(0, df.shape[0], chunk_size)]
-    return chunks
-
-# Define chunk size to ensure each file is within the limit
-max_rows_per_chunk = 100000  # Adjust based on your needs
-
-# Split the DataFrame into chunks
-chunks = split_dataframe(panel_data, max_rows_per_chunk)
-
-# Export each chunk to a separate STATA file
-output_stata_base_path = os.path.join(directory_path, 'Transformed_Panel_Data_Part')
-for i, chunk in enumerate(chunks):
-    chunk.to_stata(f'{output_stata_base_path}_{i + 1}.dta', write_index=False)
-
-print("Data transformation and export complete. Files saved as STATA files.")
+# Function to build the panel in memory from all sheets of all workbooks
+def build_panel(excel_files, args, cache, tel):
+    # Appending every sheet found in any file, opening each workbook only once
+    with tel.stage('ingest') as st:
+        appended_data_dict = append_all_sheets(excel_files, workers=args.workers, cache=cache,
+                                               progress=lambda files: tel.progress(files, 'ingest', 'Processing workbooks'))
+        results_data = appended_data_dict.pop('Results')
+        del appended_data_dict  # Free up memory
+        st['rows'], st['bytes'] = len(results_data), telemetry.file_bytes(excel_files)
+
+    # Parse each distinct "Variable\nCurrency Year" header once, then move the values
+    # straight into the company-year panel
+    with tel.stage('reshape') as st:
+        schema = parse_header_schema(results_data.columns)
+        panel = wide_to_panel(results_data, schema, ID_VARS, duplicates=args.duplicates)
+        st['rows'] = len(panel)
+    return panel
+
+# Function to stream the panel: spill each workbook's 'Results' to Parquet, then reshape bucket by bucket
+def stream_panels(excel_files, args, cache, tel):
+    files = sorted(excel_files)
+    clear_spill(args.spill_dir)
+    with tel.stage('ingest') as st:
+        results = iter_workbooks(files, ['Results'], workers=args.workers, cache=cache)
+        st['rows'], st['bytes'] = 0, telemetry.file_bytes(files)
+        for i, _file in enumerate(tel.progress(files, 'ingest', 'Processing workbooks')):
+            _, sheets = next(results)
+            if 'Results' in sheets:
+                spill_results(sheets['Results'], args.spill_dir, f'part-{i:05d}', args.buckets)
+                st['rows'] += len(sheets['Results'])
+        results.close()
+        if cache is not None:
+            cache.prune(files)
+            cache.save()
+
+    # Each company bucket is read back and reshaped as its own 'reshape' stage
+    yield from tel.timed(iter_spilled_panels(args.spill_dir, ID_VARS, duplicates=args.duplicates), 'reshape')
+
+def main():
+    parser = argparse.ArgumentParser(description='Combine Orbis exports into STATA panel files.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to parse the workbooks')
+    parser.add_argument('--cache-dir', default=None, help='Keep parsed sheets here and only re-parse new or changed workbooks')
+    parser.add_argument('--duplicates', choices=DUPLICATE_POLICIES, default='raise',
+                        help='What to do with companies or headers that appear more than once')
+    parser.add_argument('--streaming', action='store_true',
+                        help="Spill 'Results' to a Parquet dataset and reshape it one company bucket at a time")
+    parser.add_argument('--spill-dir', default=os.path.join(directory_path, 'results_spill'),
+                        help='Where the streaming mode keeps its Parquet dataset')
+    parser.add_argument('--buckets', type=int, default=16, help='Number of company buckets used by the streaming mode')
+    parser.add_argument('--write-workers', type=int, default=1, help='Number of processes writing STATA parts')
+    parser.add_argument('--float32', action='store_true', help='Store panel values as float32 even where that rounds them')
+    telemetry.add_arguments(parser, os.path.join(directory_path, 'telemetry.jsonl'))
+    args = parser.parse_args()
+
+    # Per-stage wall / CPU time, peak memory and rows go to --telemetry as JSON lines
+    tel = telemetry.from_args(args, 'Combine Orbis Data.py')
+
+    # Get all Excel files in the directory
+    excel_files = glob(os.path.join(directory_path, '*.xlsx'))
+
+    cache = ParseCache(args.cache_dir) if args.cache_dir else None
+
+    panels = stream_panels(excel_files, args, cache, tel) if args.streaming else [build_panel(excel_files, args, cache, tel)]
+
+    # Define chunk size to ensure each file is within the limit
+    max_rows_per_chunk = 100000  # Adjust based on your needs
+
+    # Export each chunk to a separate STATA file (plus a manifest and a Stata append script);
+    # bucket panels are gathered into full parts rather than written as one part each
+    output_stata_base_path = os.path.join(directory_path, 'Transformed_Panel_Data_Part')
+    writer = StataPartWriter(output_stata_base_path, max_rows_per_chunk, part_format='{base}_{i}.dta',
+                             workers=args.write_workers)
+    for panel_data in panels:
+        # Categorical ids, int16 Year and float32 values where lossless (or with --float32)
+        with tel.stage('compact') as st:
+            panel_data = compact_frame(panel_data, float32=args.float32, label='Orbis panel')
+            st['rows'] = len(panel_data)
+        # Rename columns
+        with tel.stage('write') as st:
+            writer.write(panel_data.rename(columns={'Company name Latin alphabet': 'Company Name'}))
+            st['rows'] = len(panel_data)
+    with tel.stage('write') as st:
+        writer.close()
+        st['rows'], st['bytes'] = writer.n_rows, telemetry.file_bytes(
+            [os.path.join(directory_path, part['file']) for part in writer.manifest])
+    # The spilled Parquet dataset is only needed while the panel is written
+    if args.streaming:
+        clear_spill(args.spill_dir)
+
+    if cache is not None:
+        print(cache.summary())
+    tel.close()
+    print("Data transformation and export complete. Files saved as STATA files.")
+
+if __name__ == '__main__':
+    main()
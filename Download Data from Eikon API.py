@@ -1,7 +1,15 @@
 # Pull TR.SharesHeld + TR.InvestorType + ISIN (+ extra dates) for ASOF snapshots (2000–2024) using ISIN universe
-import os, time, re, math
+import os, re, argparse
 import pandas as pd
 import eikon as ek
+from compact_dtypes import compact_frame
+from eikon_holdings import (BATCH_FRQ, FIELDS, FIELDS_BATCHED, isins_without_holdings, latest_per_isin,
+                             normalize_raw, split_asof)
+from eikon_scheduler import EikonScheduler
+from eikon_store import ResponseStore
+from holdings_store import DATE_COLS, KEY_COLS, HoldingsStore
+from stata_export import write_stata_parts
+import telemetry
 
 # ---------- CONFIG ----------
 ASOFS = [f"{y}-12-31" for y in range(2024, 1999, -1)]  # 2024 … 2000
@@ -14,178 +22,188 @@ APP_KEY = os.getenv("08006cebba014d638dfdf00043c3c664da393699") or "08006cebba01
 ek.set_app_key(APP_KEY)
 ek.set_timeout(120000)  # ms
 
-# Data fields
-FIELDS = [
-    "TR.HoldingsDate",
-    "TR.EarliestHoldingsDate",
-    "TR.prevHoldingsDate",
-    "TR.ConsHoldFilingDate",
-    "TR.SharesHeld",
-    "TR.InvestorType",
-    "TR.ISIN",
-]
-
 # Stata export
 CHUNK_ROWS = 1_000_000
 STATA_VERSION = 118
 ISIN_RE = re.compile(r"^[A-Z]{2}[A-Z0-9]{9}[0-9]$")
 
 # ---------- HELPERS ----------
-def chunks(seq, n=20):
-    for i in range(0, len(seq), n):
-        yield seq[i:i+n]
-
-def pull(univ, params, tries=3, pause=1.0):
-    """Call ek.get_data with light retry."""
-    for t in range(tries):
-        df, err = ek.get_data(univ, FIELDS, parameters=params)
-        if not err and df is not None and len(df):
-            return df
-        time.sleep(pause * (t + 1))
-    return pd.DataFrame()
-
-def ensure_dt64(df, cols):
-    """Ensure these columns are datetime64[ns] (not Python 'object' dates)."""
-    out = df.copy()
-    for c in cols:
-        if c in out.columns and not pd.api.types.is_datetime64_any_dtype(out[c]):
-            out[c] = pd.to_datetime(out[c], errors="coerce")
-    return out
-
 def write_stata_chunked(df_snapshot: pd.DataFrame, df_bytype: pd.DataFrame, base_no_ext: str):
     """
     Always write Stata .dta files.
-      - snapshot → base.dta (or base_part01.dta, base_part02.dta, … if very large)
+      - snapshot → base.dta (or base_part01.dta, base_part02.dta, … plus base_manifest.csv
+        and base_append.do if very large)
       - by_type  → base_bytype.dta
-    Dates are kept as datetime64 and converted via convert_dates={'col':'td'}.
+    Dates are converted to datetime64 chunk by chunk and written via convert_dates={'col':'td'}.
     """
-    date_cols = ["date", "earliest_date", "prev_date", "cons_filing_date"]
-    snap = ensure_dt64(df_snapshot, date_cols)
-    convert_map = {c: "td" for c in date_cols if c in snap.columns}
-
-    n = len(snap)
-    if n == 0:
+    if len(df_snapshot) == 0:
         raise ValueError("Snapshot is empty; nothing to write.")
 
-    if n <= CHUNK_ROWS:
-        snap.to_stata(base_no_ext + ".dta", write_index=False,
-                      version=STATA_VERSION, convert_dates=convert_map)
-        print(f"OK → {base_no_ext}.dta")
-    else:
-        parts = math.ceil(n / CHUNK_ROWS)
-        for i in range(parts):
-            lo, hi = i * CHUNK_ROWS, min((i + 1) * CHUNK_ROWS, n)
-            snap.iloc[lo:hi].to_stata(
-                base_no_ext + f"_part{(i+1):02d}.dta",
-                write_index=False, version=STATA_VERSION, convert_dates=convert_map
-            )
-            print(f"OK → {base_no_ext}_part{(i+1):02d}.dta  [{lo:,}:{hi:,}]")
+    write_stata_parts(df_snapshot, base_no_ext, CHUNK_ROWS, version=STATA_VERSION, date_cols=DATE_COLS)
 
     # by_type is typically small (no date columns needed)
     df_bytype.to_stata(base_no_ext + "_bytype.dta", write_index=False, version=STATA_VERSION)
     print(f"OK → {base_no_ext}_bytype.dta")
 
+# ---------- REQUEST SCHEDULER ----------
+parser = argparse.ArgumentParser(description="Pull year-end SharesHeld snapshots from Eikon into a Parquet holdings store.")
+parser.add_argument("--workers", type=int, default=4, help="ek.get_data requests kept in flight")
+parser.add_argument("--rate", type=float, default=2.0, help="Average requests per second across all workers")
+parser.add_argument("--tries", type=int, default=3, help="Attempts per chunk before it is given up")
+parser.add_argument("--store", default=os.path.join(BASE, "eikon_responses.sqlite"),
+                    help="SQLite file keeping every response, so reruns resume instead of pulling again")
+parser.add_argument("--max-age-days", type=float, default=None, help="Pull again responses older than this")
+parser.add_argument("--batched", action="store_true",
+                    help="Ask each chunk once over the full year range and split the years locally")
+parser.add_argument("--incremental", action="store_true", help="Only pull year-ends not already in the holdings store")
+parser.add_argument("--holdings", default=os.path.join(BASE, "holdings"),
+                    help="Parquet holdings store, partitioned by year")
+parser.add_argument("--stata", action="store_true",
+                    help="Also write SharesHeld{year}.dta / _bytype.dta views from the store")
+telemetry.add_arguments(parser, os.path.join(BASE, "telemetry.jsonl"))
+args = parser.parse_args()
+
+# Per-stage timings and memory, plus one record per ek.get_data request (seconds, rows, error)
+tel = telemetry.from_args(args, "Download Data from Eikon API.py")
+
+# Chunk size starts at 20 ISINs and adapts to response size and latency
+scheduler = EikonScheduler(ek.get_data, FIELDS, workers=args.workers, rate=args.rate, tries=args.tries,
+                           on_request=tel.request)
+
+# Finished chunks are served from disk; the manifest shows per-year progress
+store = ResponseStore(args.store)
+if args.max_age_days is not None:
+    print(f"Invalidated {store.invalidate(args.max_age_days)} stored responses older than {args.max_age_days} days")
+MANIFEST = os.path.join(BASE, "eikon_manifest.csv")
+
+# Canonical output: one Parquet partition per year; Stata files are derived views
+holdings = HoldingsStore(args.holdings)
+
 # ---------- LOAD ISIN UNIVERSE ----------
 assert os.path.exists(IN_XLS), f"Input file not found: {IN_XLS}"
-ids_raw = pd.read_excel(IN_XLS, sheet_name=0)
-first_col = ids_raw.columns[0]
-isins = (ids_raw[first_col].dropna().astype(str).str.strip().str.upper().unique().tolist())
-isins = [i for i in isins if ISIN_RE.fullmatch(i)]
+with tel.stage("ingest") as st:
+    ids_raw = pd.read_excel(IN_XLS, sheet_name=0)
+    first_col = ids_raw.columns[0]
+    isins = (ids_raw[first_col].dropna().astype(str).str.strip().str.upper().unique().tolist())
+    isins = [i for i in isins if ISIN_RE.fullmatch(i)]
+    st["rows"], st["bytes"] = len(isins), telemetry.file_bytes([IN_XLS])
 if not isins:
     raise SystemExit("No valid ISINs found in the first column of USA1_ISIN.xlsx")
 print(f"Universe size (ISINs): {len(isins)}")
 
 # ---------- YEAR-END LOOP ----------
-for asof in ASOFS:
+asofs = [a for a in ASOFS if not (args.incremental and holdings.has_year(a[:4]))]
+if args.incremental:
+    print(f"Year-ends to pull: {len(asofs)} of {len(ASOFS)}")
+
+# Batched mode: one range query per chunk instead of one query per chunk and year-end
+range_raw = None
+if args.batched and asofs:
+    params_range = {"SDate": min(asofs), "EDate": max(asofs), "Frq": BATCH_FRQ}
+    label = f"{min(asofs)[:4]}-{max(asofs)[:4]} range"
+    with tel.stage("fetch", request=label) as st:
+        range_raw = scheduler.fetch(isins, params_range, store=store, fields=FIELDS_BATCHED, label=label)
+        st["rows"] = len(range_raw)
+    range_failed = list(scheduler.failed)
+    if not range_raw.empty:
+        # The multi-year pull is the largest frame kept in memory: keep ISINs / types as categoricals
+        with tel.stage("reshape", request=label) as st:
+            range_raw = compact_frame(normalize_raw(range_raw, max(asofs)), categorical=KEY_COLS + ["ISIN_in"],
+                                      label="range pull")
+            st["rows"] = len(range_raw)
+
+for asof in asofs:
+    year = asof[:4]
     try:
-        year = asof[:4]
         base_no_ext = os.path.join(BASE, f"SharesHeld{year}")  # output base name (no extension)
 
         params_asof = {"SDate": asof, "EDate": asof}
         params_fb   = {"SDate": f"{year}-01-01", "EDate": asof, "Frq": "Q"}
 
-        # Pull AS-OF, then fallback if needed
-        parts = [pull(ch, params_asof) for ch in chunks(isins, 20)]
-        raw = pd.concat([p for p in parts if p is not None and len(p)], ignore_index=True) if parts else pd.DataFrame()
-
-        used_fallback = False
-        if raw.empty:
-            parts = [pull(ch, params_fb) for ch in chunks(isins, 20)]
-            raw = pd.concat([p for p in parts if p is not None and len(p)], ignore_index=True) if parts else pd.DataFrame()
-            if raw.empty:
-                raise ValueError(f"No rows returned for {asof} (as-of & fallback).")
-            used_fallback = True
-
-        # Normalize headers to consistent names
-        COLS = {
-            "Instrument": "Instrument",
-
-            "TR.HoldingsDate": "date", "Holdings Date": "date", "Date": "date",
-            "TR.EarliestHoldingsDate": "earliest_date", "Earliest Holdings Date": "earliest_date",
-            "TR.prevHoldingsDate": "prev_date", "Previous Holdings Date": "prev_date", "Prev Holdings Date": "prev_date",
-            "TR.ConsHoldFilingDate": "cons_filing_date", "Consolidated Holdings Filing Date": "cons_filing_date",
-            "Cons Hold Filing Date": "cons_filing_date",
-
-            "TR.SharesHeld": "SharesHeld", "Investor Shares Held": "SharesHeld",
-            "TR.InvestorType": "InvestorType", "Investor Type": "InvestorType", "Investor Type Description": "InvestorType",
-
-            "TR.ISIN": "ISIN", "ISIN": "ISIN", "ISIN Code": "ISIN",
-        }
-        raw = raw.rename(columns={k: v for k, v in COLS.items() if k in raw.columns})
-
-        # Ensure / parse dates (KEEP as datetime64[ns])
-        if "date" not in raw.columns:
-            raw["date"] = pd.to_datetime(asof)
+        # Pull AS-OF for the whole universe (or cut it from the range pull)
+        if range_raw is not None:
+            with tel.stage("reshape", year=year) as st:
+                raw = split_asof(range_raw, asof) if not range_raw.empty else range_raw
+                st["rows"] = len(raw)
+            asof_failed = range_failed
         else:
-            raw["date"] = pd.to_datetime(raw["date"], errors="coerce")
-            if raw["date"].isna().all():
-                raw["date"] = pd.to_datetime(asof)
-        for c in ["earliest_date", "prev_date", "cons_filing_date"]:
-            if c in raw.columns:
-                raw[c] = pd.to_datetime(raw[c], errors="coerce")
+            with tel.stage("fetch", year=year, request=f"{year} as-of") as st:
+                raw = scheduler.fetch(isins, params_asof, store=store, label=f"{year} as-of")
+                st["rows"] = len(raw)
+            asof_failed = list(scheduler.failed)
+            with tel.stage("reshape", year=year) as st:
+                raw = normalize_raw(raw, asof) if not raw.empty else raw
+                st["rows"] = len(raw)
+
+        # Fallback only for ISINs the as-of pull answered with no holdings (empty or all-NaN);
+        # their latest record up to ASOF is merged into the as-of snapshot. ISINs whose as-of
+        # request failed are left out: they are reported and pulled again on the next run
+        failed_asof = set(asof_failed)
+        missing_isins = [i for i in isins_without_holdings(raw, isins) if i not in failed_asof]
+        fallback_failed = []
+        if missing_isins:
+            with tel.stage("fetch", year=year, request=f"{year} fallback") as st:
+                fb = scheduler.fetch(missing_isins, params_fb, store=store, label=f"{year} fallback")
+                st["rows"] = len(fb)
+            fallback_failed = list(scheduler.failed)
+            filled = set()
+            if not fb.empty:
+                with tel.stage("merge", year=year) as st:
+                    fb = latest_per_isin(normalize_raw(fb, asof))
+                    filled = set(fb.loc[fb["SharesHeld"].notna(), "ISIN_in"])
+                    if not raw.empty:
+                        raw = raw.loc[~raw["ISIN_in"].isin(filled)]
+                    raw = pd.concat([raw, fb.loc[fb["ISIN_in"].isin(filled)]], ignore_index=True)
+                    st["rows"] = len(raw)
+            print(f"{asof}: fallback for {len(missing_isins)} ISINs, {len(filled)} filled")
+        if raw.empty:
+            raise ValueError(f"No rows returned for {asof} (as-of & fallback).")
 
         # Core validations
-        need = {"Instrument", "date", "SharesHeld", "InvestorType"}
-        missing = sorted(list(need - set(raw.columns)))
-        if missing:
-            raise ValueError(f"{asof}: Missing required columns {missing}.")
-
-        raw["SharesHeld"]   = pd.to_numeric(raw["SharesHeld"], errors="coerce")
-        raw["InvestorType"] = raw["InvestorType"].astype(str)
         if raw["SharesHeld"].isna().all():
             raise ValueError(f"{asof}: TR.SharesHeld all NaN.")
         if (raw["InvestorType"].str.strip() == "").all():
             raise ValueError(f"{asof}: TR.InvestorType empty.")
 
-        # Inputs are ISINs; anchor ISIN to input, prefer TR.ISIN when present
-        raw["ISIN_in"] = raw["Instrument"].astype(str).str.upper()
-        if "ISIN" in raw.columns:
-            raw["ISIN"] = raw["ISIN"].astype(str).str.upper()
-            raw["ISIN"] = raw["ISIN"].where(raw["ISIN"].str.strip() != "", raw["ISIN_in"])
-        else:
-            raw["ISIN"] = raw["ISIN_in"]
-
-        # If fallback, keep latest record per ISIN up to ASOF
-        if used_fallback and raw["date"].notna().any():
-            raw = raw.loc[raw["date"].eq(raw.groupby("ISIN")["date"].transform("max"))].copy()
-
-        # ----- OUTPUTS (STATA) -----
+        # ----- OUTPUTS (HOLDINGS STORE, STATA VIEW ON DEMAND) -----
         cols_snapshot = ["ISIN", "date", "earliest_date", "prev_date", "cons_filing_date",
                          "InvestorType", "SharesHeld"]
         cols_snapshot = [c for c in cols_snapshot if c in raw.columns]
 
-        snapshot = (raw[cols_snapshot]
-                    .sort_values(["ISIN", "InvestorType"] if "InvestorType" in cols_snapshot else ["ISIN"])
-                    .reset_index(drop=True))
+        with tel.stage("compact", year=year) as st:
+            snapshot = (raw[cols_snapshot]
+                        .sort_values(["ISIN", "InvestorType"] if "InvestorType" in cols_snapshot else ["ISIN"])
+                        .reset_index(drop=True))
+            snapshot = compact_frame(snapshot, categorical=KEY_COLS, label=f"{year} snapshot")
+            st["rows"] = len(snapshot)
 
-        by_type = (snapshot.groupby(["ISIN", "InvestorType"], as_index=False)["SharesHeld"]
-                   .sum()
-                   .rename(columns={"SharesHeld": f"SharesHeld_{year}_AsOf"}))
+        if asof_failed or fallback_failed:
+            print(f"[WARN] {asof}: {len(asof_failed) + len(fallback_failed)} ISINs failed after {args.tries} tries "
+                  f"({len(asof_failed)} as-of, {len(fallback_failed)} fallback); rerun to pull them again.")
+            tel.event("failed_isins", year=year, isins=len(asof_failed) + len(fallback_failed),
+                      asof=len(asof_failed), fallback=len(fallback_failed), tries=args.tries)
 
-        if snapshot.empty or by_type.empty:
+        if snapshot.empty:
             raise ValueError(f"{asof}: Processed frames are empty.")
 
-        write_stata_chunked(snapshot, by_type, base_no_ext)
+        with tel.stage("write", year=year) as st:
+            holdings.write_year(year, snapshot)
+            st["rows"] = len(snapshot)
+        print(f"OK → {holdings.root} (year={year}, {len(snapshot):,} rows)")
+
+        if args.stata:
+            with tel.stage("write", year=year, output="stata") as st:
+                snap, by_type = holdings.stata_view(year)
+                write_stata_chunked(snap, by_type, base_no_ext)
+                st["rows"] = len(snap)
 
     except Exception as e:
+        # A stage that raised is recorded with status 'error'; this also covers the validations
         print(f"[ERROR] {asof}: {e}")
+        tel.event("error", year=year, error=f"{type(e).__name__}: {e}")
+    finally:
+        store.manifest().to_csv(MANIFEST, index=False)
+
+print(store.manifest().to_string(index=False))
+store.close()
+tel.close()
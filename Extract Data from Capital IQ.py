@@ -1,45 +1,77 @@
 import os
-import time
+import argparse
 import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.common.by import By
-from selenium.webdriver.edge.options import Options  # Changed from Chrome to Edge
+from ciq_downloader import LOGIN_URL, REPORT_URL, download_all, edge_driver_factory
+from ciq_manifest import DownloadManifest
+import telemetry
 
 # Load the data with company IDs
-df = pd.read_excel('C:/Users/habim/Desktop/company_data.xlsx')
-
-# Set up the Edge WebDriver
-options = Options()
-options.add_experimental_option("prefs", {
-    "download.default_directory": r"C:\Users\habim\Desktop\Downloaded_Reports",
-    "download.prompt_for_download": False,
-    "download.directory_upgrade": True,
-    "safebrowsing.enabled": True
-})
-driver = webdriver.Edge(executable_path='C:/path/to/msedgedriver.exe', options=options)  # Path to Edge WebDriver
-
-# Function to log into Capital IQ
-def login():
-    driver.get('https://www.capitaliq.com')
-    time.sleep(2)  # Adjust based on your connection speed
-    driver.find_element(By.ID, 'username').send_keys('YourUsername')
-    driver.find_element(By.ID, 'password').send_keys('YourPassword', Keys.RETURN)
-
-# Function to navigate and download reports
-def download_reports(company_id):
-    report_url = f'https://www.capitaliq.com/CIQDotNet/Filings/FilingsAnnualReports.aspx?CompanyId={company_id}'
-    driver.get(report_url)
-    # Assume the correct element ID for the download button
-    download_button = driver.find_element(By.ID, 'download_button_id')
-    download_button.click()
-    time.sleep(5)  # Wait for the download to complete
-
-# Main script execution
-login()
-time.sleep(5)  # Wait for the login to complete
-
-for company_id in df['CompanyID']:
-    download_reports(company_id)
-
-driver.quit()  # Close the browser once done
+company_file = 'C:/Users/habim/Desktop/company_data.xlsx'
+
+# Downloaded reports are collected here
+download_dir = r"C:\Users\habim\Desktop\Downloaded_Reports"
+
+# Path to Edge WebDriver (None: let Selenium locate msedgedriver)
+driver_path = 'C:/path/to/msedgedriver.exe'
+
+# Capital IQ credentials
+username = 'YourUsername'
+password = 'YourPassword'
+
+def main():
+    parser = argparse.ArgumentParser(description='Download annual report filings from Capital IQ.')
+    parser.add_argument('--sessions', type=int, default=2, help='Number of browser sessions sharing the company queue')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for a page element')
+    parser.add_argument('--download-timeout', type=float, default=300, help='Seconds to wait for a download to finish')
+    parser.add_argument('--headless', action='store_true', help='Run the browsers without a window')
+    parser.add_argument('--login-url', default=LOGIN_URL, help='Login page (e.g. a local stub server for testing)')
+    parser.add_argument('--report-url', default=REPORT_URL, help='Report page template with {company_id}')
+    parser.add_argument('--manifest', default=os.path.join(download_dir, 'ciq_manifest.sqlite'),
+                        help='Record of downloaded files and attempts; completed companies are skipped on reruns')
+    parser.add_argument('--max-attempts', type=int, default=3, help='Give up on a company after this many failed attempts')
+    telemetry.add_arguments(parser, os.path.join(download_dir, 'telemetry.jsonl'))
+    args = parser.parse_args()
+
+    # One 'download' record per company (status, seconds, bytes) and one stage per round
+    tel = telemetry.from_args(args, 'Extract Data from Capital IQ.py')
+
+    df = pd.read_excel(company_file)
+    company_ids = df['CompanyID'].tolist()
+
+    os.makedirs(download_dir, exist_ok=True)
+    manifest = DownloadManifest(args.manifest)
+    print(manifest.summary(company_ids, download_dir, args.max_attempts))
+
+    # Function to log each finished company and record it in the manifest straight away
+    def on_result(r):
+        manifest.record(r)
+        tel.event('download', company_id=str(r['company_id']), status=r['status'], seconds=round(r['seconds'], 3),
+                  files=len(r['files']), bytes=telemetry.file_bytes(r['files']), error=r['error'])
+        print(f"{r['company_id']}: {r['status']} ({r['seconds']:.1f} s)" + (f" - {r['error']}" if r['error'] else ''))
+
+    # Each round only visits outstanding companies: completed ones are skipped and failed
+    # ones are retried until they reach --max-attempts failures
+    for round_no in range(1, args.max_attempts + 1):
+        todo, _done, _given_up = manifest.plan(company_ids, download_dir, args.max_attempts)
+        if not todo:
+            break
+        # Each session logs in once, then takes the next CompanyID from the shared queue;
+        # pages are awaited with explicit waits and downloads by watching the download folder
+        with tel.stage('download', round=round_no) as st:
+            results = download_all(todo, edge_driver_factory(driver_path, args.headless), download_dir,
+                                   username, password, sessions=args.sessions, login_url=args.login_url,
+                                   report_url=args.report_url, timeout=args.timeout,
+                                   download_timeout=args.download_timeout, on_result=on_result)
+            st['rows'] = sum(r['status'] == 'done' for r in results)
+            st['bytes'] = telemetry.file_bytes([f for r in results for f in r['files']])
+
+    manifest.index().to_csv(os.path.splitext(args.manifest)[0] + '.csv', index=False)
+    print(manifest.summary(company_ids, download_dir, args.max_attempts))
+    _todo, _done, given_up = manifest.plan(company_ids, download_dir, args.max_attempts)
+    if given_up:
+        print(f"Given up: {given_up}")
+    manifest.close()
+    tel.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,57 +1,49 @@
-import pandas as pd
 import os
+import argparse
 from glob import glob
+from compact_dtypes import compact_frame
+from excel_ingest import append_all_sheets
+from output_writers import FORMATS, write_table
+from orbis_panel import ID_VARS, DUPLICATE_POLICIES, parse_header_schema, wide_to_panel
 
 # Path to the directory containing the Excel files
 directory_path = r'C:\Users\habim\OneDrive - Hanken Svenska handelshogskolan\Desktop\All\Orbis\Profit_Loss'
 
-# Get all Excel files in the directory
-excel_files = glob(os.path.join(directory_path, '*.xlsx'))
-
-# Function to read and append sheets with the same name
-def append_sheets(sheet_name, files):
-    appended_data = pd.DataFrame()
-    for file in files:
-        xls = pd.ExcelFile(file)
-        if sheet_name in xls.sheet_names:
-            df = xls.parse(sheet_name)
-            appended_data = pd.concat([appended_data, df], ignore_index=True)
-    return appended_data
-
-# Appending each sheet separately
-sheets = pd.ExcelFile(excel_files[0]).sheet_names
-appended_data_dict = {sheet: append_sheets(sheet, excel_files) for sheet in sheets}
-
-# Example sheet: 'Results'
-results_data = appended_data_dict['Results']
-
-# Transforming the 'Results' sheet into panel data
-# Extract year, variable name, and currency from the column names
-def extract_year_variable_currency(column_name):
-    parts = column_name.split(' ')
-    year = parts[-1]
-    variable = ' '.join(parts[:-3]).replace('\n', ' ')
-    currency = parts[-2]
-    return variable, year, currency
-
-# Melt the DataFrame to long format
-melted_df = results_data.melt(id_vars=['Company name Latin alphabet', 'Country', 'Country ISO code'], 
-                              var_name='Variable_Year', value_name='Value')
-
-# Extract Variable, Year, and Currency from the 'Variable_Year' column
-melted_df[['Variable', 'Year', 'Currency']] = melted_df['Variable_Year'].str.extract(r'(.+)\n(.+)\s(.+)$')
-melted_df['Variable'] = melted_df['Variable'].str.replace('\n', ' ')
-melted_df['Unit'] = 'A Million'
-
-# Pivot the DataFrame to get variables as columns
-panel_data = melted_df.pivot_table(index=['Company name Latin alphabet', 'Country', 'Country ISO code', 'Year', 'Currency', 'Unit'], 
-                                   columns='Variable', values='Value').reset_index()
-
-# Rename columns
-panel_data = panel_data.rename(columns={'Company name Latin alphabet': 'Company Name'})
-
-# Export the panel data to Excel
-output_file_path = os.path.join(directory_path, 'Transformed_Panel_Data.xlsx')
-panel_data.to_excel(output_file_path, index=False)
-
-print(f"Data transformation complete. File saved as '{output_file_path}'")
+def main():
+    parser = argparse.ArgumentParser(description='Transform Orbis Profit & Loss exports into a panel workbook.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to parse the workbooks')
+    parser.add_argument('--duplicates', choices=DUPLICATE_POLICIES, default='raise',
+                        help='What to do with companies or headers that appear more than once')
+    parser.add_argument('--format', choices=FORMATS, default='xlsx', help='Output format of Transformed_Panel_Data')
+    parser.add_argument('--float32', action='store_true', help='Store panel values as float32 even where that rounds them')
+    args = parser.parse_args()
+
+    # Get all Excel files in the directory
+    excel_files = glob(os.path.join(directory_path, '*.xlsx'))
+
+    # Appending every sheet found in any file, opening each workbook only once
+    appended_data_dict = append_all_sheets(excel_files, workers=args.workers)
+
+    # Example sheet: 'Results'
+    results_data = appended_data_dict['Results']
+
+    # Parse each distinct "Variable\nCurrency Year" header once, then move the values
+    # straight into the company-year panel
+    schema = parse_header_schema(results_data.columns)
+    panel_data = wide_to_panel(results_data, schema, ID_VARS, duplicates=args.duplicates)
+    del appended_data_dict, results_data  # Free up memory
+
+    # Categorical ids, int16 Year and float32 values where lossless (or with --float32)
+    panel_data = compact_frame(panel_data, float32=args.float32, label='Orbis panel')
+
+    # Rename columns
+    panel_data = panel_data.rename(columns={'Company name Latin alphabet': 'Company Name'})
+
+    # Export the panel data (Excel by default, streamed; see --format)
+    output_file_path = os.path.join(directory_path, f'Transformed_Panel_Data.{args.format}')
+    write_table(panel_data, output_file_path)
+
+    print(f"Data transformation complete. File saved as '{output_file_path}'")
+
+if __name__ == '__main__':
+    main()
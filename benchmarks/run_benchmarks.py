@@ -0,0 +1,275 @@
+"""
+Offline benchmarks of every pipeline stage on synthetic data.
+
+    python benchmarks/run_benchmarks.py --scale 1 --pipelines orbis ciq lseg eikon
+
+Each stage is measured by telemetry.Telemetry (wall and CPU time, peak RSS, rows) and
+appended to benchmarks/results.jsonl; stages are compared with the previous run at the
+same scale, so regressions stand out. --profile cprofile / sample profiles the stages.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import warnings
+from contextlib import contextmanager, redirect_stdout
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+import pandas as pd  # noqa: E402
+from pandas.errors import InvalidColumnName  # noqa: E402
+
+from compact_dtypes import compact_frame  # noqa: E402
+from eikon_holdings import (BATCH_FRQ, FIELDS, FIELDS_BATCHED, isins_without_holdings, normalize_raw,  # noqa: E402
+                             split_asof)
+from eikon_scheduler import EikonScheduler  # noqa: E402
+from eikon_store import ResponseStore  # noqa: E402
+from excel_ingest import append_all_sheets  # noqa: E402
+from holdings_store import KEY_COLS, HoldingsStore  # noqa: E402
+from lseg_panel import balanced_panel, join_metrics, read_wide_sheet  # noqa: E402
+from orbis_panel import ID_VARS, iter_spilled_panels, parse_header_schema, spill_results, wide_to_panel  # noqa: E402
+from output_writers import TableWriter, write_table  # noqa: E402
+from stata_export import StataPartWriter, write_stata_parts  # noqa: E402
+import telemetry  # noqa: E402
+from synthetic import fake_get_data, make_ciq_exports, make_isins, make_lseg_workbook, make_orbis_workbooks  # noqa: E402
+
+PIPELINES = ('orbis', 'ciq', 'lseg', 'eikon')
+RESULTS_FILE = os.path.join(HERE, 'results.jsonl')
+
+
+class Recorder:
+    """Run each benchmark stage as a telemetry stage tagged with its pipeline."""
+
+    def __init__(self, tel, verbose=False):
+        self.tel = tel
+        self.verbose = verbose
+
+    @property
+    def rows(self):
+        return self.tel.stages
+
+    @contextmanager
+    def stage(self, pipeline, stage):
+        # The pipelines' own progress output is muted unless --verbose
+        with open(os.devnull, 'w') as devnull, redirect_stdout(sys.stdout if self.verbose else devnull):
+            with self.tel.stage(stage, pipeline=pipeline) as info:
+                yield info
+        row = self.rows[-1]
+        peak = '     n/a' if row['peak_rss_mb'] is None else f"{row['peak_rss_mb']:8.1f}"
+        print(f"{pipeline:>6} {stage:<14} {row['seconds']:8.2f} s  cpu {row['cpu_seconds']:8.2f} s  "
+              f"peak {peak} MB  rows {row['rows'] if row['rows'] is not None else '-'}")
+
+
+def load_script(file_name):
+    """Import one of the repository scripts (file names contain spaces) without running main()."""
+    spec = importlib.util.spec_from_file_location(os.path.splitext(file_name)[0].replace(' ', '_'),
+                                                  os.path.join(ROOT, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_orbis(rec, workdir, scale):
+    files = make_orbis_workbooks(os.path.join(workdir, 'orbis'), n_files=4, companies_per_file=max(10, int(500 * scale)))
+    out = os.path.join(workdir, 'orbis_out')
+    os.makedirs(out, exist_ok=True)
+
+    with rec.stage('orbis', 'ingest') as s:
+        results = append_all_sheets(files)['Results']
+        s['rows'] = len(results)
+    with rec.stage('orbis', 'reshape') as s:
+        panel = wide_to_panel(results, parse_header_schema(results.columns), ID_VARS)
+        s['rows'] = len(panel)
+    with rec.stage('orbis', 'compact') as s:
+        panel = compact_frame(panel)
+        s['rows'] = len(panel)
+    with rec.stage('orbis', 'export_dta') as s:
+        writer = StataPartWriter(os.path.join(out, 'Transformed_Panel_Data_Part'), 100000, part_format='{base}_{i}.dta')
+        writer.write(panel.rename(columns={'Company name Latin alphabet': 'Company Name'}))
+        writer.close()
+        s['rows'] = len(panel)
+    with rec.stage('orbis', 'export_xlsx') as s:
+        write_table(panel, os.path.join(out, 'Transformed_Panel_Data.xlsx'))
+        s['rows'] = len(panel)
+    with rec.stage('orbis', 'stream') as s:
+        spill_dir = os.path.join(out, 'results_spill')
+        for i, file in enumerate(files):
+            spill_results(pd.read_excel(file, sheet_name='Results'), spill_dir, f'part-{i:05d}')
+        s['rows'] = sum(len(p) for p in iter_spilled_panels(spill_dir, ID_VARS))
+
+
+def bench_ciq(rec, workdir, scale):
+    directory = os.path.join(workdir, 'ciq')
+    make_ciq_exports(directory, n_files=max(2, int(20 * scale)), rows=200)
+    ciq = load_script('Append All CIQ Data.py')
+    files = [f for f in sorted(os.listdir(directory)) if f.endswith('.xlsx') and not f.startswith('~$')]
+
+    with rec.stage('ciq', 'ingest') as s:
+        sheets = append_all_sheets([os.path.join(directory, f) for f in files], transform=ciq.prepare_sheet)
+        s['rows'] = sum(len(df) for df in sheets.values())
+    with rec.stage('ciq', 'export_xlsx') as s:
+        writer = TableWriter(os.path.join(workdir, 'Appended_SheetsAll.xlsx'))
+        for sheet, data in sheets.items():
+            writer.write(data, sheet)
+        writer.close()
+        s['rows'] = sum(len(df) for df in sheets.values())
+
+
+def bench_lseg(rec, workdir, scale):
+    ctp = load_script('Codes to panel data.py')
+    n = max(20, int(2000 * scale))
+    workbooks = {metric: make_lseg_workbook(os.path.join(workdir, f'{metric}.xlsx'), 'Western Asia', n, seed=i)
+                 for i, metric in enumerate(['Total Assets', 'Revenue'])}
+
+    with rec.stage('lseg', 'ingest') as s:
+        sheets = {metric: read_wide_sheet(path, 'Western Asia', ctp.YEAR_MIN, ctp.YEAR_MAX)
+                  for metric, path in workbooks.items()}
+        s['rows'] = sum(len(data) for data, _ in sheets.values())
+    with rec.stage('lseg', 'panel') as s:
+        panels = []
+        for metric, (data, header) in sheets.items():
+            meta_cols = [c for c in header['meta_names'] if c != 'ISIN']
+            year_cols = [c for c in data.columns if isinstance(c, int)]
+            panels.append((metric, balanced_panel(data, 'ISIN', meta_cols, year_cols, ctp.YEARS_ALL, metric,
+                                                  ctp.DUPLICATES), meta_cols))
+        s['rows'] = sum(len(panel) for _, panel, _ in panels)
+    with rec.stage('lseg', 'join') as s:
+        panel, meta_cols, metrics = join_metrics(panels, 'ISIN', ctp.DUPLICATES)
+        panel = ctp.finish_panel(panel, 'ISIN', meta_cols, metrics)
+        s['rows'] = len(panel)
+    with rec.stage('lseg', 'export_xlsx') as s:
+        write_table(panel, os.path.join(workdir, 'All Regions_Panel.xlsx'), na_rep=ctp.MISSING_VALUE, na_cols=metrics)
+        s['rows'] = len(panel)
+
+
+def bench_eikon(rec, workdir, scale):
+    import numpy as np
+
+    isins = make_isins(max(20, int(2000 * scale)), np.random.default_rng(0))
+    store = ResponseStore(os.path.join(workdir, 'eikon_store.sqlite'))
+    scheduler = EikonScheduler(fake_get_data(holders_per_isin=20), FIELDS, workers=4, rate=1000.0,
+                               sleep=lambda seconds: None, on_request=rec.tel.request)
+    params_asof = {"SDate": "2024-12-31", "EDate": "2024-12-31"}
+    asofs = [f"{y}-12-31" for y in range(2020, 2025)]
+    params_range = {"SDate": min(asofs), "EDate": max(asofs), "Frq": BATCH_FRQ}
+
+    with rec.stage('eikon', 'fetch') as s:
+        raw = scheduler.fetch(isins, params_asof, store=store, label='2024 as-of')
+        s['rows'] = len(raw)
+    with rec.stage('eikon', 'resume') as s:
+        raw = scheduler.fetch(isins, params_asof, store=store, label='2024 as-of')
+        s['rows'] = len(raw)
+    with rec.stage('eikon', 'fetch_range') as s:
+        range_raw = scheduler.fetch(isins, params_range, store=store, fields=FIELDS_BATCHED, label='2020-2024 range')
+        s['rows'] = len(range_raw)
+    store.close()
+
+    # The same normalisation, fallback selection and year split as the download script
+    with rec.stage('eikon', 'normalize') as s:
+        raw = normalize_raw(raw, "2024-12-31")
+        isins_without_holdings(raw, isins)
+        s['rows'] = len(raw)
+    with rec.stage('eikon', 'split_asof') as s:
+        range_raw = compact_frame(normalize_raw(range_raw, max(asofs)), categorical=KEY_COLS + ["ISIN_in"])
+        s['rows'] = sum(len(split_asof(range_raw, asof)) for asof in asofs)
+    with rec.stage('eikon', 'compact') as s:
+        cols = ["ISIN", "date", "earliest_date", "prev_date", "cons_filing_date", "InvestorType", "SharesHeld"]
+        snapshot = compact_frame(raw[cols].sort_values(KEY_COLS).reset_index(drop=True), categorical=KEY_COLS)
+        s['rows'] = len(snapshot)
+    holdings = HoldingsStore(os.path.join(workdir, 'holdings'))
+    with rec.stage('eikon', 'store_write') as s:
+        holdings.write_year(2024, snapshot)
+        s['rows'] = len(snapshot)
+    with rec.stage('eikon', 'store_read') as s:
+        snap, by_type = holdings.stata_view(2024)
+        s['rows'] = len(snap)
+    with rec.stage('eikon', 'export_dta') as s:
+        write_stata_parts(snap, os.path.join(workdir, 'SharesHeld2024'), 1_000_000, version=118,
+                          date_cols=['date', 'earliest_date', 'prev_date', 'cons_filing_date'])
+        by_type.to_stata(os.path.join(workdir, 'SharesHeld2024_bytype.dta'), write_index=False, version=118)
+        s['rows'] = len(snap)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(results_file):
+    """Stage records of earlier runs in the results file."""
+    if not results_file or not os.path.exists(results_file):
+        return []
+    with open(results_file, encoding='utf-8') as fh:
+        return [r for r in map(json.loads, filter(str.strip, fh)) if r.get('event') == 'stage']
+
+
+def compare(rows, history, threshold):
+    """Return (row, baseline) pairs for stages more than `threshold` times slower than in the previous run at the same scale."""
+    # Baseline: the latest earlier record of each stage at the same scale
+    baseline = {}
+    for r in history:
+        if r.get('scale') == rows[0]['scale'] and 'pipeline' in r:
+            key = (r['pipeline'], r['stage'])
+            if key not in baseline or r['run'] >= baseline[key]['run']:
+                baseline[key] = r
+    slower = []
+    for row in rows:
+        base = baseline.get((row['pipeline'], row['stage']))
+        # Sub-50 ms stages are too noisy to compare
+        if base and row['seconds'] > 0.05 and row['seconds'] > threshold * base['seconds']:
+            slower.append((row, base))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipelines on synthetic data (offline).')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplies the number of companies, files and ISINs')
+    parser.add_argument('--pipelines', nargs='+', choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument('--workdir', default=None, help='Where synthetic inputs and outputs go (default: a temp folder)')
+    parser.add_argument('--keep', action='store_true', help='Keep the synthetic inputs and outputs')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Slowdown vs. the previous run flagged as a regression')
+    parser.add_argument('--verbose', action='store_true', help="Show the pipelines' own progress output")
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 when a stage regressed')
+    telemetry.add_arguments(parser, RESULTS_FILE)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='pipeline_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    history = load_history(args.telemetry)
+    run_info = {'commit': _git_commit(), 'scale': args.scale, 'python': platform.python_version(),
+                'pandas': pd.__version__, 'machine': platform.node()}
+    tel = telemetry.from_args(args, 'run_benchmarks.py', context=run_info, echo=False)
+    rec = Recorder(tel, args.verbose)
+    # Synthetic Orbis names are not valid Stata variable names; the renaming warning is expected
+    warnings.simplefilter('ignore', InvalidColumnName)
+    benches = {'orbis': bench_orbis, 'ciq': bench_ciq, 'lseg': bench_lseg, 'eikon': bench_eikon}
+    try:
+        for name in args.pipelines:
+            benches[name](rec, workdir, args.scale)
+    finally:
+        tel.close()
+        if not args.keep and args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    slower = compare(rec.rows, history, args.threshold) if rec.rows else []
+    if args.telemetry:
+        print(f"Results appended to {args.telemetry}")
+    for row, base in slower:
+        print(f"[REGRESSION] {row['pipeline']}/{row['stage']}: {row['seconds']:.2f} s vs {base['seconds']:.2f} s "
+              f"in run {base['run']} ({base['commit']})")
+    if slower and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
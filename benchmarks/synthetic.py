@@ -0,0 +1,171 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+ORBIS_ID_VARS = ['Company name Latin alphabet', 'Country', 'Country ISO code']
+ORBIS_VARIABLES = ['Total assets', 'Operating revenue (Turnover)', 'P/L before tax', 'Number of employees',
+                   'Shareholders funds', 'Current liabilities']
+COUNTRIES = [('Germany', 'DE'), ('France', 'FR'), ('Finland', 'FI'), ('Sweden', 'SE'), ('Rwanda', 'RW'),
+             ('United States of America', 'US'), ('Japan', 'JP')]
+CIQ_SHEETS = ['Income Statement', 'Balance Sheet', 'Cash Flow']
+INVESTOR_TYPES = ['Investment Advisor', 'Hedge Fund', 'Pension Fund', 'Individual Investor', 'Bank and Trust',
+                  'Insurance Company', 'Sovereign Wealth Fund']
+
+
+# Function to write frames as sheets of one workbook (xlsxwriter is much faster than openpyxl here)
+def _write_workbook(path, sheets, header=True):
+    with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False, header=header)
+
+
+def make_isins(n, rng, prefix='US'):
+    """n distinct ISIN-like codes."""
+    digits = rng.choice(10 ** 9, size=n, replace=False)
+    return [f"{prefix}{d:09d}{i % 10}" for i, d in enumerate(digits)]
+
+
+def make_orbis_workbooks(directory, n_files=4, companies_per_file=500, years=range(2014, 2024),
+                         variables=ORBIS_VARIABLES, missing=0.2, seed=0):
+    """
+    Orbis exports: a 'Results' sheet with the three id columns and one "Variable\\nth USD Year"
+    column per variable and year (a share of cells blank or "n.a."), plus a small 'Notes' sheet.
+    Returns the workbook paths.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for f in range(n_files):
+        n = companies_per_file
+        country = rng.integers(len(COUNTRIES), size=n)
+        results = {
+            'Company name Latin alphabet': [f"COMPANY {f:03d}-{i:06d} AG" for i in range(n)],
+            'Country': [COUNTRIES[c][0] for c in country],
+            'Country ISO code': [COUNTRIES[c][1] for c in country],
+        }
+        for variable in variables:
+            for year in years:
+                values = rng.lognormal(3, 2, n).round(3).astype(object)
+                values[rng.random(n) < missing] = 'n.a.'
+                results[f"{variable}\nth USD {year}"] = values
+        path = os.path.join(directory, f"Orbis_Export_{f:03d}.xlsx")
+        _write_workbook(path, {'Results': pd.DataFrame(results),
+                               'Notes': pd.DataFrame({'Note': ['Synthetic Orbis export']})})
+        paths.append(path)
+    return paths
+
+
+def make_ciq_exports(directory, n_files=20, rows=200, sheets=CIQ_SHEETS, seed=0):
+    """
+    Capital IQ exports named CIQ_<Company>_<id>.xlsx, each with several sheets that carry a
+    'Filing Date', value columns and blank-header (Unnamed) columns, plus a '~$' lock file
+    for every fifth workbook, as Excel leaves behind. Returns the workbook paths.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for f in range(n_files):
+        frames = {}
+        for sheet in sheets:
+            df = pd.DataFrame({
+                'Filing Date': pd.Timestamp('2000-01-01') + pd.to_timedelta(rng.integers(0, 9000, rows), unit='D'),
+                'Line Item': [f"Item {i % 40}" for i in range(rows)],
+                'Value': rng.normal(1e6, 5e5, rows).round(2),
+                'blank_1': None,
+                'Currency': 'USD',
+                'blank_2': np.where(rng.random(rows) < 0.1, 'see note', None),
+            })
+            # Blank headers are read back as "Unnamed: 3" and "Unnamed: 5"
+            frames[sheet] = df.set_axis(['Filing Date', 'Line Item', 'Value', '', 'Currency', ''], axis=1)
+        path = os.path.join(directory, f"CIQ_Company{f:04d}_{100000 + f}.xlsx")
+        _write_workbook(path, frames)
+        paths.append(path)
+        if f % 5 == 0:
+            with open(os.path.join(directory, f"~$CIQ_Company{f:04d}_{100000 + f}.xlsx"), 'wb') as fh:
+                fh.write(b'\x00' * 165)
+    return paths
+
+
+def make_lseg_workbook(path, sheet, n_isins=2000, years=range(2000, 2025), duplicates=0.01, text_cells=0.02,
+                       missing=0.3, seed=0):
+    """
+    A regional LSEG sheet: row 0 has the metadata headers and "year" over each time-series
+    column, row 1 is blank, row 2 has the years and data starts on row 3. Some ISINs are
+    repeated, some cells are blank and some hold text ("NULL").
+    """
+    rng = np.random.default_rng(seed)
+    years = list(years)
+    isins = make_isins(n_isins, rng)
+    n_dup = int(n_isins * duplicates)
+    if n_dup:
+        isins += list(rng.choice(isins, n_dup, replace=False))
+    n = len(isins)
+    country = rng.integers(len(COUNTRIES), size=n)
+    meta = [['Identifier', 'Company Name', 'Country of Headquarters', 'ISIN', 'TRBC Industry Name']
+            + ['year'] * len(years),
+            [None] * (5 + len(years)),
+            [None] * 5 + years]
+    values = rng.lognormal(5, 2, (n, len(years))).round(2).astype(object)
+    values[rng.random(values.shape) < missing] = None
+    values[rng.random(values.shape) < text_cells] = 'NULL'
+    rows = [[f"{isin[:6]}.X", f"Company {i}", COUNTRIES[country[i]][0], isin, f"Industry {i % 60}"] + list(values[i])
+            for i, isin in enumerate(isins)]
+    _write_workbook(path, {sheet: pd.DataFrame(meta + rows)}, header=False)
+    return path
+
+
+# Function to list the period ends an Eikon range query returns (year-ends, or quarter-ends for Frq='Q')
+def _period_ends(sdate, edate, frq):
+    start, end = pd.Timestamp(sdate), pd.Timestamp(edate)
+    if frq == 'Q':
+        ends = pd.period_range(start, end, freq='Q').to_timestamp(how='end').normalize()
+    else:
+        ends = pd.DatetimeIndex([pd.Timestamp(year=y, month=12, day=31) for y in range(start.year, end.year + 1)])
+    ends = ends[(ends >= start) & (ends <= end)]
+    return ends if len(ends) else pd.DatetimeIndex([end])
+
+
+def fake_get_data(holders_per_isin=20, error_rate=0.0, seed=0):
+    """
+    Stand-in for ek.get_data(instruments, fields, parameters=...) returning (df, err) with
+    Eikon's column headers; error_rate makes that share of calls fail like a throttled request.
+      - Without Frq the call is an as-of query: one set of holders per ISIN, dated up to EDate.
+      - With Frq (a range query) there is one set per period end between SDate and EDate
+        (year-ends, quarter-ends for 'Q'), tagged with its Calc Date when a calcdate field is asked.
+    """
+    rng = np.random.default_rng(seed)
+    lock = threading.Lock()  # the scheduler calls get_data from several threads
+
+    def get_data(instruments, fields, parameters=None):
+        parameters = parameters or {}
+        edate = parameters.get('EDate', '2024-12-31')
+        if parameters.get('Frq'):
+            periods = _period_ends(parameters.get('SDate', edate), edate, parameters['Frq'])
+        else:
+            periods = pd.DatetimeIndex([pd.Timestamp(edate)])
+        with lock:
+            failed = bool(error_rate) and rng.random() < error_rate
+            per_period = len(instruments) * holders_per_isin
+            n = per_period * len(periods)
+            lags, shares, types = rng.integers(0, 90, n), rng.integers(1, 10 ** 7, n), rng.choice(INVESTOR_TYPES, n)
+        if failed:
+            return None, [{'code': 429, 'message': 'Too many requests, please try again later.'}]
+        dates = pd.DatetimeIndex(np.repeat(periods.to_numpy(), per_period))
+        isins = np.tile(np.repeat(instruments, holders_per_isin), len(periods))
+        df = pd.DataFrame({
+            'Instrument': isins,
+            'Holdings Date': (dates - pd.to_timedelta(lags, unit='D')).strftime('%Y-%m-%d'),
+            'Earliest Holdings Date': '2000-03-31',
+            'Previous Holdings Date': (dates - pd.Timedelta(days=92)).strftime('%Y-%m-%d'),
+            'Consolidated Holdings Filing Date': dates.strftime('%Y-%m-%d'),
+            'Investor Shares Held': shares.astype('float64'),
+            'Investor Type': types,
+            'ISIN': isins,
+        })
+        if any('calcdate' in f.lower() for f in fields):
+            df['Calc Date'] = dates.strftime('%Y-%m-%d')
+        return df, None
+
+    return get_data
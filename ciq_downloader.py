@@ -0,0 +1,196 @@
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+LOGIN_URL = 'https://www.capitaliq.com'
+REPORT_URL = 'https://www.capitaliq.com/CIQDotNet/Filings/FilingsAnnualReports.aspx?CompanyId={company_id}'
+USERNAME_ID = 'username'
+PASSWORD_ID = 'password'
+DOWNLOAD_BUTTON_ID = 'download_button_id'  # Assume the correct element ID for the download button
+
+# Files the browser is still writing
+PARTIAL_SUFFIXES = ('.crdownload', '.partial', '.part', '.tmp')
+
+
+# Function to create an Edge driver that saves downloads to download_dir without asking
+def edge_driver_factory(driver_path=None, headless=False):
+    def make_driver(download_dir):
+        from selenium.webdriver.edge.options import Options
+        from selenium.webdriver.edge.service import Service
+
+        options = Options()
+        if headless:
+            options.add_argument('--headless=new')
+        options.add_experimental_option("prefs", {
+            "download.default_directory": os.path.abspath(download_dir),
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+            "safebrowsing.enabled": True
+        })
+        return webdriver.Edge(service=Service(driver_path) if driver_path else None, options=options)
+    return make_driver
+
+
+# Function to wait until a download started after `before` has finished
+def wait_for_download(directory, before, timeout=300, poll=0.25, clock=time.monotonic, sleep=time.sleep):
+    """
+    Return the paths of files that appeared in `directory` since the `before` listing, once
+    no new partial (.crdownload, ...) file is left and their sizes are stable over one poll.
+    Raise TimeoutError if that does not happen within `timeout` seconds.
+    Only names in `before` are ignored: a download that was still running when `before` was
+    taken can finish under a new name and would be returned, so leftovers of a failed
+    download have to be cleared first (see quarantine_downloads).
+    """
+    deadline = clock() + timeout
+    last_sizes = None
+    while clock() < deadline:
+        names = set(os.listdir(directory)) - before
+        new = sorted(n for n in names if not n.endswith(PARTIAL_SUFFIXES) and not n.startswith('.'))
+        if new and not any(n.endswith(PARTIAL_SUFFIXES) for n in names):
+            sizes = [os.path.getsize(os.path.join(directory, n)) for n in new]
+            if sizes == last_sizes:
+                return [os.path.join(directory, n) for n in new]
+            last_sizes = sizes
+        sleep(poll)
+    raise TimeoutError(f"No finished download in {directory} after {timeout:.0f} s")
+
+
+# Function to move everything a failed download left behind out of the session folder
+def quarantine_downloads(directory, stale_dir, company_id, timeout=300, poll=0.25,
+                         clock=time.monotonic, sleep=time.sleep):
+    """
+    Give partial files in `directory` up to `timeout` seconds to finish, then move every
+    file into stale_dir (named <company_id>_<name>), so a late download cannot be taken for
+    the next company's file. Returns False if a partial file was still there (the browser
+    is still writing it and has to be restarted to stop it).
+    """
+    deadline = clock() + timeout
+    while any(n.endswith(PARTIAL_SUFFIXES) for n in os.listdir(directory)) and clock() < deadline:
+        sleep(poll)
+    os.makedirs(stale_dir, exist_ok=True)
+    settled = True
+    for name in os.listdir(directory):
+        if name.startswith('.'):
+            continue
+        settled = settled and not name.endswith(PARTIAL_SUFFIXES)
+        target = os.path.join(stale_dir, f"{company_id}_{name}")
+        i = 1
+        while os.path.exists(target):
+            i += 1
+            target = os.path.join(stale_dir, f"{company_id}_{i}_{name}")
+        try:
+            shutil.move(os.path.join(directory, name), target)
+        except OSError:  # still open in the browser (Windows)
+            settled = False
+    return settled
+
+
+class CIQSession:
+    """
+    One logged-in browser. Page readiness is checked with explicit waits (WebDriverWait) and
+    downloads are detected in the session's own download folder, so no fixed sleeps are needed.
+    """
+
+    def __init__(self, driver, download_dir, timeout=60, download_timeout=300):
+        self.driver = driver
+        self.download_dir = download_dir
+        self.wait = WebDriverWait(driver, timeout)
+        self.download_timeout = download_timeout
+
+    def login(self, username, password, url=LOGIN_URL):
+        self.driver.get(url)
+        self.wait.until(EC.presence_of_element_located((By.ID, USERNAME_ID))).send_keys(username)
+        password_field = self.driver.find_element(By.ID, PASSWORD_ID)
+        password_field.send_keys(password, Keys.RETURN)
+        # The login form is replaced once the next page has loaded
+        self.wait.until(EC.staleness_of(password_field))
+
+    def download(self, company_id, report_url=REPORT_URL):
+        """Open the company's annual reports page, click download and return the finished file(s)."""
+        self.driver.get(report_url.format(company_id=company_id))
+        button = self.wait.until(EC.element_to_be_clickable((By.ID, DOWNLOAD_BUTTON_ID)))
+        before = set(os.listdir(self.download_dir))
+        button.click()
+        return wait_for_download(self.download_dir, before, self.download_timeout)
+
+
+# Function to move a finished download into the shared folder, keeping its name unless it is taken
+def _move_download(path, target_dir, company_id):
+    name = os.path.basename(path)
+    target = os.path.join(target_dir, name)
+    if os.path.exists(target):
+        target = os.path.join(target_dir, f"{company_id}_{name}")
+    shutil.move(path, target)
+    return target
+
+
+def download_all(company_ids, driver_factory, download_dir, username, password, sessions=2,
+                 login_url=LOGIN_URL, report_url=REPORT_URL, timeout=60, download_timeout=300, on_result=None):
+    """
+    Download the reports of every company with `sessions` browsers sharing one work queue.
+      - driver_factory(session_dir) returns a WebDriver that saves downloads to session_dir
+        (e.g. edge_driver_factory(); a headless driver and a local stub server work as well).
+      - Each session downloads into download_dir/.session<i>, so a finished file is always
+        matched to the right company; it is then moved into download_dir.
+      - A company whose page or download times out is reported as failed and the session
+        moves on to the next one. Whatever that download leaves in the session folder is
+        moved to download_dir/.stale once it settles; if it is still being written after
+        download_timeout, the browser is restarted (which cancels it) and logged in again.
+    Returns one dict per company (company_id, status 'done'/'failed', files, error, seconds);
+    on_result(result) is called as each company finishes.
+    """
+    os.makedirs(download_dir, exist_ok=True)
+    queue = deque(company_ids)
+    lock = threading.Lock()
+    results = []
+
+    def worker(i):
+        session_dir = os.path.join(download_dir, f'.session{i}')
+        os.makedirs(session_dir, exist_ok=True)
+        stale_dir = os.path.join(download_dir, '.stale')
+        driver = driver_factory(session_dir)
+        try:
+            session = CIQSession(driver, session_dir, timeout, download_timeout)
+            session.login(username, password, login_url)
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    company_id = queue.popleft()
+                start = time.monotonic()
+                try:
+                    files = session.download(company_id, report_url)
+                    with lock:
+                        files = [_move_download(f, download_dir, company_id) for f in files]
+                    result = {'company_id': company_id, 'status': 'done', 'files': files, 'error': None}
+                except (TimeoutError, TimeoutException, WebDriverException) as e:
+                    result = {'company_id': company_id, 'status': 'failed', 'files': [], 'error': str(e).strip()}
+                    # A timed-out download may still finish under a new name; clear it before the next click
+                    if not quarantine_downloads(session_dir, stale_dir, company_id, download_timeout):
+                        driver.quit()
+                        driver = driver_factory(session_dir)
+                        session = CIQSession(driver, session_dir, timeout, download_timeout)
+                        session.login(username, password, login_url)
+                        quarantine_downloads(session_dir, stale_dir, company_id, 0)
+                result['seconds'] = time.monotonic() - start
+                with lock:
+                    results.append(result)
+                if on_result is not None:
+                    on_result(result)
+        finally:
+            driver.quit()
+
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        for future in [pool.submit(worker, i) for i in range(sessions)]:
+            future.result()
+    return results
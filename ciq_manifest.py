@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from parse_cache import file_sha256
+
+
+class DownloadManifest:
+    """
+    SQLite record of Capital IQ downloads, so a rerun only visits outstanding companies.
+      - `files` maps each CompanyID to its downloaded file(s) with size, SHA-256 and time.
+      - `attempts` logs every try (status, error, seconds); failures count towards the cap.
+      - A company is complete while its recorded files still exist with the recorded size.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS attempts (
+                    id INTEGER PRIMARY KEY, company_id TEXT, attempted_at REAL, status TEXT,
+                    error TEXT, seconds REAL);
+                CREATE TABLE IF NOT EXISTS files (
+                    company_id TEXT, file TEXT, size INTEGER, sha256 TEXT, downloaded_at REAL,
+                    PRIMARY KEY (company_id, file));
+            """)
+
+    def record(self, result):
+        """Store one download_all result; files of a successful download are checksummed."""
+        company_id = str(result['company_id'])
+        rows = [(company_id, os.path.basename(f), os.path.getsize(f), file_sha256(f), time.time())
+                for f in result['files']]
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO attempts (company_id, attempted_at, status, error, seconds) VALUES (?, ?, ?, ?, ?)",
+                              (company_id, time.time(), result['status'], result['error'], result.get('seconds')))
+            if result['status'] == 'done':
+                self.conn.execute("DELETE FROM files WHERE company_id = ?", (company_id,))
+                self.conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", rows)
+
+    def completed(self, download_dir):
+        """CompanyIDs whose recorded files are all still in download_dir with the recorded size."""
+        with self.lock:
+            rows = self.conn.execute("SELECT company_id, file, size FROM files").fetchall()
+        missing, seen = set(), set()
+        for company_id, name, size in rows:
+            seen.add(company_id)
+            path = os.path.join(download_dir, name)
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                missing.add(company_id)
+        return seen - missing
+
+    def failures(self):
+        """Failed attempts per CompanyID since its last successful download."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT company_id, COUNT(*) FROM attempts a WHERE status != 'done' AND attempted_at > "
+                "COALESCE((SELECT MAX(attempted_at) FROM attempts b WHERE b.company_id = a.company_id "
+                "AND b.status = 'done'), 0) GROUP BY company_id").fetchall()
+        return dict(rows)
+
+    def plan(self, company_ids, download_dir, max_attempts=3):
+        """
+        Split company_ids into (todo, done, given_up): done companies are skipped, failed ones
+        are retried until they reach max_attempts failures, then given up on.
+        """
+        done_ids, failures = self.completed(download_dir), self.failures()
+        todo, done, given_up = [], [], []
+        for company_id in dict.fromkeys(company_ids):
+            key = str(company_id)
+            if key in done_ids:
+                done.append(company_id)
+            elif failures.get(key, 0) >= max_attempts:
+                given_up.append(company_id)
+            else:
+                todo.append(company_id)
+        return todo, done, given_up
+
+    def summary(self, company_ids, download_dir, max_attempts=3):
+        todo, done, given_up = self.plan(company_ids, download_dir, max_attempts)
+        failures = self.failures()
+        retries = sum(1 for c in todo if failures.get(str(c)))
+        return (f"Download manifest: {len(done):,} done, {len(todo):,} outstanding ({retries:,} retries), "
+                f"{len(given_up):,} given up after {max_attempts} failed attempts")
+
+    def index(self):
+        """One row per downloaded file: CompanyID, file, size, checksum and download time."""
+        with self.lock:
+            rows = self.conn.execute("SELECT company_id, file, size, sha256, downloaded_at FROM files "
+                                     "ORDER BY company_id, file").fetchall()
+        out = pd.DataFrame(rows, columns=["company_id", "file", "size", "sha256", "downloaded_at"])
+        out["downloaded_at"] = pd.to_datetime(out["downloaded_at"], unit="s")
+        return out
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+YEAR_COLS = ("Year", "year")
+
+
+# Function to measure the in-memory size of a frame, strings included
+def memory_mb(df):
+    return df.memory_usage(deep=True, index=True).sum() / 1e6
+
+
+# Function to tell whether float64 values survive a round trip through float32
+def _fits_float32(values):
+    values = np.asarray(values, dtype="float64")
+    return np.array_equal(values.astype("float32").astype("float64"), values, equal_nan=True)
+
+
+# Function to shrink a frame to compact dtypes and report the memory saved
+def compact_frame(df, categorical=(), exclude=(), max_unique_ratio=0.5, year_cols=YEAR_COLS,
+                  float32=False, label=None):
+    """
+    Return `df` with compact dtypes:
+      - columns in `categorical`, and text columns whose distinct values are at most
+        max_unique_ratio of the rows, become categoricals;
+      - year columns (whole numbers or digit strings, no missing values) become int16;
+      - other integers are downcast to the smallest integer type;
+      - float64 values become float32 when that is lossless, or always with float32=True.
+    Columns in `exclude` are left alone. With a label, memory before and after is printed.
+    """
+    before = memory_mb(df) if label else None
+    out = df.copy(deep=False)
+    for col in df.columns:
+        s = df[col]
+        if col in exclude or isinstance(s.dtype, pd.CategoricalDtype) and col not in year_cols:
+            continue
+        if col in year_cols:
+            years = pd.to_numeric(s.astype(str) if isinstance(s.dtype, pd.CategoricalDtype) else s, errors="coerce")
+            # Only whole years are cast, so "2020.1" is never truncated to 2020
+            if (len(years) and years.notna().all() and (years % 1 == 0).all()
+                    and years.between(-32768, 32767).all()):
+                out[col] = years.astype("int16")
+        elif pd.api.types.is_bool_dtype(s.dtype):
+            continue
+        elif pd.api.types.is_integer_dtype(s.dtype) and isinstance(s.dtype, np.dtype):
+            out[col] = pd.to_numeric(s, downcast="integer")
+        elif s.dtype == np.float64:
+            if float32 or _fits_float32(s.to_numpy()):
+                out[col] = s.astype("float32")
+        elif pd.api.types.is_object_dtype(s.dtype) or pd.api.types.is_string_dtype(s.dtype):
+            if col in categorical or (len(s) and s.nunique(dropna=True) <= max_unique_ratio * len(s)):
+                out[col] = s.astype("category")
+    if label:
+        print(f"{label}: {before:,.1f} MB → {memory_mb(out):,.1f} MB")
+    return out
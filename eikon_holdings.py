@@ -0,0 +1,96 @@
+import pandas as pd
+
+# Data fields
+FIELDS = [
+    "TR.HoldingsDate",
+    "TR.EarliestHoldingsDate",
+    "TR.prevHoldingsDate",
+    "TR.ConsHoldFilingDate",
+    "TR.SharesHeld",
+    "TR.InvestorType",
+    "TR.ISIN",
+]
+# Batched mode: one range query per chunk at year-end frequency; the calc date tags the
+# year-end each row belongs to
+BATCH_FRQ = "CY"
+FIELDS_BATCHED = FIELDS + ["TR.SharesHeld.calcdate"]
+
+# Normalize headers to consistent names
+COLS = {
+    "Instrument": "Instrument",
+
+    "TR.HoldingsDate": "date", "Holdings Date": "date", "Date": "date",
+    "TR.EarliestHoldingsDate": "earliest_date", "Earliest Holdings Date": "earliest_date",
+    "TR.prevHoldingsDate": "prev_date", "Previous Holdings Date": "prev_date", "Prev Holdings Date": "prev_date",
+    "TR.ConsHoldFilingDate": "cons_filing_date", "Consolidated Holdings Filing Date": "cons_filing_date",
+    "Cons Hold Filing Date": "cons_filing_date",
+
+    "TR.SharesHeld": "SharesHeld", "Investor Shares Held": "SharesHeld",
+    "TR.InvestorType": "InvestorType", "Investor Type": "InvestorType", "Investor Type Description": "InvestorType",
+
+    "TR.ISIN": "ISIN", "ISIN": "ISIN", "ISIN Code": "ISIN",
+
+    "TR.SharesHeld.calcdate": "period", "Calc Date": "period",
+}
+
+
+def normalize_raw(raw, asof):
+    """Rename Eikon headers, parse dates (KEEP as datetime64[ns]) and anchor ISIN to the input."""
+    raw = raw.rename(columns={k: v for k, v in COLS.items() if k in raw.columns})
+
+    # Ensure / parse dates
+    if "date" not in raw.columns:
+        raw["date"] = pd.to_datetime(asof)
+    else:
+        raw["date"] = pd.to_datetime(raw["date"], errors="coerce")
+        if raw["date"].isna().all():
+            raw["date"] = pd.to_datetime(asof)
+    for c in ["earliest_date", "prev_date", "cons_filing_date", "period"]:
+        if c in raw.columns:
+            raw[c] = pd.to_datetime(raw[c], errors="coerce")
+
+    need = {"Instrument", "date", "SharesHeld", "InvestorType"}
+    missing = sorted(list(need - set(raw.columns)))
+    if missing:
+        raise ValueError(f"{asof}: Missing required columns {missing}.")
+
+    raw["SharesHeld"]   = pd.to_numeric(raw["SharesHeld"], errors="coerce")
+    raw["InvestorType"] = raw["InvestorType"].astype(str)
+
+    # Inputs are ISINs; anchor ISIN to input, prefer TR.ISIN when present
+    raw["ISIN_in"] = raw["Instrument"].astype(str).str.upper()
+    if "ISIN" in raw.columns:
+        raw["ISIN"] = raw["ISIN"].astype(str).str.upper()
+        raw["ISIN"] = raw["ISIN"].where(raw["ISIN"].str.strip() != "", raw["ISIN_in"])
+    else:
+        raw["ISIN"] = raw["ISIN_in"]
+    return raw
+
+
+def isins_without_holdings(raw, isins):
+    """Input ISINs with no row, or only NaN TR.SharesHeld, in a normalized pull."""
+    if raw.empty:
+        return list(isins)
+    covered = set(raw.loc[raw["SharesHeld"].notna(), "ISIN_in"])
+    return [i for i in isins if i not in covered]
+
+
+def latest_per_isin(raw):
+    """Keep the latest record per ISIN (all rows of that date) up to ASOF."""
+    if raw["date"].notna().any():
+        raw = raw.loc[raw["date"].eq(raw.groupby("ISIN")["date"].transform("max"))].copy()
+    return raw
+
+
+def split_asof(raw, asof):
+    """
+    Cut the year-end snapshot for ASOF out of a normalized multi-year pull.
+      - Rows tagged with a calc date (period) in (ASOF - 1 year, ASOF] form the snapshot.
+      - Without calc dates, keep the latest record per ISIN dated on or before ASOF,
+        as the as-of query would.
+    """
+    end = pd.Timestamp(asof)
+    if "period" in raw.columns and raw["period"].notna().any():
+        start = end - pd.DateOffset(years=1)
+        return raw.loc[(raw["period"] > start) & (raw["period"] <= end)].copy()
+    return latest_per_isin(raw.loc[raw["date"] <= end])
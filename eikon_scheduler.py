@@ -0,0 +1,178 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+THROTTLE_HINTS = ("429", "too many", "throttl", "rate limit", "backend error")
+
+
+def is_throttled(error):
+    """True if an ek.get_data error (exception or error list) looks like a throttling response."""
+    text = str(error).lower()
+    return any(hint in text for hint in THROTTLE_HINTS)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0, rng=random):
+    """Exponential backoff with full jitter: uniform in [0, min(cap, base * 2**attempt)]."""
+    return rng.uniform(0.0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    Allow `rate` requests per second on average, with bursts up to `capacity`.
+    throttle() cuts the rate after a throttling error; recover() slowly restores it.
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=0.05, clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+    def throttle(self, factor=0.5):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * factor)
+
+    def recover(self, factor=1.1):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate * factor)
+
+
+class AdaptiveChunker:
+    """
+    Choose how many ISINs go into the next request.
+      - Halve the chunk after a failure, a slow response (> target_seconds) or a response
+        larger than max_rows; grow it by half while responses are fast and small.
+    """
+
+    def __init__(self, size=20, min_size=5, max_size=100, target_seconds=15.0, max_rows=100_000):
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+
+    def report(self, seconds, n_rows, ok):
+        with self.lock:
+            if not ok or seconds > self.target_seconds or n_rows > self.max_rows:
+                self.size = max(self.min_size, self.size // 2)
+            elif seconds < self.target_seconds / 2 and n_rows < self.max_rows / 2:
+                self.size = min(self.max_size, self.size + max(1, self.size // 2))
+
+
+class EikonScheduler:
+    """
+    Keep up to `workers` ek.get_data requests in flight over a shared ISIN queue.
+      - get_data has the ek.get_data signature (instruments, fields, parameters=...) and
+        returns (df, err), so a local fake can stand in for the API.
+      - Every request waits on the token bucket; failed or empty-with-error responses are
+        retried up to `tries` times with jittered exponential backoff, and throttling
+        errors also slow the bucket down.
+      - on_request(isins, params, seconds, n_rows, err) is called after every request.
+    ISINs whose chunk still failed after all tries in the last fetch() are listed in `failed`.
+    """
+
+    def __init__(self, get_data, fields, workers=4, rate=2.0, tries=3, chunker=None,
+                 backoff_base=1.0, backoff_cap=60.0, on_request=None, sleep=time.sleep):
+        self.get_data = get_data
+        self.fields = fields
+        self.workers = workers
+        self.bucket = TokenBucket(rate, sleep=sleep)
+        self.tries = tries
+        self.chunker = chunker or AdaptiveChunker()
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.on_request = on_request
+        self.sleep = sleep
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def _request(self, isins, params, fields):
+        for attempt in range(self.tries):
+            self.bucket.acquire()
+            start = time.monotonic()
+            try:
+                df, err = self.get_data(isins, fields, parameters=params)
+            except Exception as exc:  # ek raises EikonError on HTTP errors and timeouts
+                df, err = None, exc
+            seconds = time.monotonic() - start
+            n_rows = 0 if df is None else len(df)
+            if self.on_request is not None:
+                self.on_request(isins, params, seconds, n_rows, err)
+
+            if n_rows or (df is not None and not err):
+                self.chunker.report(seconds, n_rows, True)
+                self.bucket.recover()
+                return df, True
+            # Any failed attempt shrinks the chunk, however fast it came back
+            self.chunker.report(seconds, n_rows, False)
+            if is_throttled(err):
+                self.bucket.throttle()
+            if attempt + 1 < self.tries:
+                self.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+        with self.lock:
+            self.failed.extend(isins)
+        return pd.DataFrame(), False
+
+    def _worker(self, queue, params, fields, results, store, key):
+        while True:
+            with self.lock:
+                if not queue:
+                    return
+                n = min(self.chunker.size, len(queue))
+                batch = [queue.popleft() for _ in range(n)]
+            position = batch[0][0]
+            isins = [isin for _, isin in batch]
+            df, ok = self._request(isins, params, fields)
+            if ok and store is not None:
+                store.save(key, isins, df)
+            with self.lock:
+                results.append((position, df))
+
+    def fetch(self, isins, params, store=None, label=None, fields=None):
+        """
+        Pull `fields` (default: the scheduler's FIELDS) for every ISIN with `params`;
+        responses are concatenated in universe order.
+        With a ResponseStore, ISINs already completed for this request are served from disk
+        and each new response is saved as soon as it arrives.
+        """
+        fields = fields or self.fields
+        results = []
+        self.failed = []
+        key = None
+        todo = list(enumerate(isins))
+        if store is not None:
+            key = store.register(fields, params, label)
+            position = {isin: i for i, isin in enumerate(isins)}
+            for covered, df in store.load(key, isins):
+                results.append((min(position[isin] for isin in covered), df))
+            done = store.completed(key)
+            todo = [(i, isin) for i, isin in todo if isin not in done]
+
+        queue = deque(todo)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for future in [pool.submit(self._worker, queue, params, fields, results, store, key) for _ in range(self.workers)]:
+                future.result()
+        frames = [df for _, df in sorted(results, key=lambda r: r[0]) if df is not None and len(df)]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+
+class ResponseStore:
+    """
+    SQLite store of ek.get_data responses, so an interrupted download can resume.
+      - A request is identified by (FIELDS, parameters); every stored response records
+        which ISINs it covered, so a rerun only pulls ISINs not yet completed for that
+        request, even if the chunk sizes differ between runs.
+      - Each request carries a label (e.g. "2009 as-of") used by manifest().
+      - invalidate(max_age_days) drops responses older than the given age.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS requests (
+                    request_key TEXT PRIMARY KEY, label TEXT, fields TEXT, params TEXT);
+                CREATE TABLE IF NOT EXISTS responses (
+                    id INTEGER PRIMARY KEY, request_key TEXT, fetched_at REAL, n_isins INTEGER,
+                    n_rows INTEGER, payload BLOB);
+                CREATE TABLE IF NOT EXISTS done (
+                    request_key TEXT, isin TEXT, response_id INTEGER, PRIMARY KEY (request_key, isin));
+            """)
+
+    @staticmethod
+    def request_key(fields, params):
+        text = json.dumps({"fields": list(fields), "params": params}, sort_keys=True)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def register(self, fields, params, label):
+        key = self.request_key(fields, params)
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?)",
+                              (key, label, json.dumps(list(fields)), json.dumps(params, sort_keys=True)))
+        return key
+
+    def completed(self, key):
+        with self.lock:
+            rows = self.conn.execute("SELECT isin FROM done WHERE request_key = ?", (key,)).fetchall()
+        return {isin for (isin,) in rows}
+
+    def save(self, key, isins, df):
+        """Store one successful response and mark its ISINs as completed."""
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO responses (request_key, fetched_at, n_isins, n_rows, payload) VALUES (?, ?, ?, ?, ?)",
+                (key, time.time(), len(isins), len(df), pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)))
+            self.conn.executemany("INSERT OR REPLACE INTO done VALUES (?, ?, ?)",
+                                  [(key, isin, cur.lastrowid) for isin in isins])
+
+    def load(self, key, isins):
+        """Yield (isins covered, DataFrame) for stored responses of `key` that cover any of `isins`."""
+        wanted = set(isins)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT r.id, r.payload, group_concat(d.isin) FROM responses r JOIN done d ON d.response_id = r.id "
+                "WHERE r.request_key = ? GROUP BY r.id ORDER BY r.id", (key,)).fetchall()
+        for _id, payload, covered in rows:
+            covered = [isin for isin in covered.split(",") if isin in wanted]
+            if covered:
+                df = pickle.loads(payload)
+                if "Instrument" in df.columns:
+                    df = df[df["Instrument"].astype(str).str.upper().isin(covered)]
+                yield covered, df
+
+    def invalidate(self, max_age_days):
+        """Drop responses older than max_age_days so they are pulled again."""
+        cutoff = time.time() - max_age_days * 86400
+        with self.lock, self.conn:
+            stale = "SELECT id FROM responses WHERE fetched_at < ?"
+            self.conn.execute(f"DELETE FROM done WHERE response_id IN ({stale})", (cutoff,))
+            n = self.conn.execute("DELETE FROM responses WHERE fetched_at < ?", (cutoff,)).rowcount
+        return n
+
+    def manifest(self):
+        """Per-request progress: ISINs completed, rows stored and when they were last fetched."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT q.label, q.params, COUNT(DISTINCT d.isin), "
+                "(SELECT COALESCE(SUM(n_rows), 0) FROM responses r WHERE r.request_key = q.request_key), "
+                "(SELECT MAX(fetched_at) FROM responses r WHERE r.request_key = q.request_key) "
+                "FROM requests q LEFT JOIN done d ON d.request_key = q.request_key "
+                "GROUP BY q.request_key ORDER BY q.label DESC").fetchall()
+        out = pd.DataFrame(rows, columns=["label", "params", "isins_done", "rows", "last_fetched"])
+        out["last_fetched"] = pd.to_datetime(out["last_fetched"], unit="s")
+        return out
+
+    def close(self):
+        self.conn.close()
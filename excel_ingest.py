@@ -0,0 +1,165 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from parse_cache import write_entry
+
+
+# Function to pick one dtype that can hold every piece of a column (the union schema)
+def _union_dtype(dtypes, has_gaps):
+    kinds = {dt.kind for dt in dtypes}
+    if kinds == {'M'}:
+        return np.result_type(*dtypes)
+    if kinds <= {'i', 'u', 'f'} or kinds == {'b'}:
+        dtype = np.result_type(*dtypes)
+        if has_gaps and dtype.kind in 'iu':
+            return np.dtype('float64')  # missing rows become NaN, as with pd.concat
+        if has_gaps and dtype.kind == 'b':
+            return np.dtype(object)
+        return dtype
+    return np.dtype(object)
+
+
+# Function to build one output column in a single preallocated array
+def _assemble_column(pieces, n_rows):
+    covered = sum(len(values) for _, values in pieces)
+    dtype = _union_dtype([values.dtype for _, values in pieces], covered < n_rows)
+    out = np.empty(n_rows, dtype=dtype)
+    if covered < n_rows:
+        out[:] = np.datetime64('NaT') if dtype.kind == 'M' else np.nan
+    for offset, values in pieces:
+        out[offset:offset + len(values)] = values
+    return out
+
+
+class ColumnarAppender:
+    """
+    Collect frames column by column and assemble the result in one final step.
+      - The column order and dtypes are the union over every appended frame, so files with
+        extra or missing columns line up without repeated pd.concat calls.
+      - Each column is copied once into a preallocated array, and its pieces are released
+        as soon as it is built, so peak memory stays close to one copy of the output.
+    """
+
+    def __init__(self):
+        self._pieces = {}  # column name -> [(row offset, values), ...]
+        self.n_rows = 0
+
+    def append(self, df):
+        for name in df.columns:
+            self._pieces.setdefault(name, []).append((self.n_rows, df[name].to_numpy(copy=True)))
+        self.n_rows += len(df)
+
+    def finish(self):
+        data = {}
+        for name in list(self._pieces):
+            data[name] = _assemble_column(self._pieces.pop(name), self.n_rows)
+        self.n_rows = 0
+        return pd.DataFrame(data, copy=False)
+
+
+# Function to list the sheets of a workbook and parse the wanted ones, opening the file only once
+def _parse_workbook(file, sheet_names=None):
+    with pd.ExcelFile(file) as xls:
+        wanted = [s for s in xls.sheet_names if sheet_names is None or s in sheet_names]
+        return xls.sheet_names, {sheet: xls.parse(sheet) for sheet in wanted}
+
+
+# Function to read every wanted sheet of a workbook while opening the file only once
+def read_workbook(file, sheet_names=None):
+    """Return {sheet_name: DataFrame} for the sheets of `file` listed in `sheet_names`
+    (every sheet if None). Sheets missing from this workbook are simply left out."""
+    return _parse_workbook(file, sheet_names)[1]
+
+
+# Function to apply the per-file transform to every sheet of a workbook
+def _apply_transform(sheets, file, transform):
+    if transform is None:
+        return sheets
+    return {sheet: transform(df, file) for sheet, df in sheets.items()}
+
+
+# Function run inside a worker: parse one workbook, cache the raw sheets and apply the transform there
+def _read_and_transform(file, sheet_names, transform, cache_dir=None):
+    all_sheet_names, sheets = _parse_workbook(file, sheet_names)
+    entry = write_entry(cache_dir, file, all_sheet_names, sheets) if cache_dir else None
+    return _apply_transform(sheets, file, transform), entry
+
+
+# Function to parse workbooks (optionally in a process pool) and stream them back in order
+def iter_workbooks(files, sheet_names=None, transform=None, workers=1, cache=None):
+    """
+    Yield (file, {sheet_name: DataFrame}) for every file, in the order given.
+      - workers > 1 parses files in a process pool; transform(df, file) runs in the worker,
+        so it must be a module-level (picklable) function.
+      - At most 2 * workers files are in flight, so finished results do not pile up
+        while the caller is still consuming earlier ones.
+      - With a ParseCache, unchanged workbooks are loaded from the cache instead of parsed,
+        and newly parsed ones are written to it.
+    """
+    cache_dir = cache.cache_dir if cache is not None else None
+
+    def submit(pool, file):
+        cached = cache.lookup(file, sheet_names) if cache is not None else None
+        if cached is not None:
+            result = (_apply_transform(cached, file, transform), None)
+        elif pool is None:
+            result = _read_and_transform(file, sheet_names, transform, cache_dir)
+        else:
+            return pool.submit(_read_and_transform, file, sheet_names, transform, cache_dir)
+        future = Future()
+        future.set_result(result)
+        return future
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    window = 2 * workers if pool is not None else 1
+    try:
+        pending = deque()
+        todo = iter(files)
+        for file in todo:
+            pending.append((file, submit(pool, file)))
+            if len(pending) >= window:
+                break
+        while pending:
+            file, future = pending.popleft()
+            sheets, entry = future.result()
+            if entry is not None:
+                cache.record(file, entry)
+            next_file = next(todo, None)
+            if next_file is not None:
+                pending.append((next_file, submit(pool, next_file)))
+            yield file, sheets
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+# Function to append sheets with the same name across all files in one pass
+def append_all_sheets(files, sheet_names=None, transform=None, progress=None, workers=1, cache=None):
+    """
+    Open each workbook once and route every sheet to a per-sheet accumulator.
+      - Files are processed in filename order, so the output is reproducible for any `workers`.
+      - sheet_names=None collects every sheet found in any file (in order of first
+        appearance), so sheets that only exist in later files are kept as well.
+      - transform(df, file) is applied to each parsed sheet before it is appended.
+      - progress wraps the file iterable (e.g. tqdm) if given.
+      - cache (a ParseCache) skips re-parsing unchanged workbooks; entries for files no
+        longer in `files` are evicted and the cache index is saved at the end.
+    Returns {sheet_name: DataFrame}; a requested sheet found in no file gives an empty frame.
+    """
+    files = sorted(files)
+    results = iter_workbooks(files, sheet_names, transform, workers, cache)
+
+    accumulators = {sheet: ColumnarAppender() for sheet in (sheet_names or [])}
+    for _file in (progress(files) if progress else files):
+        _, sheets = next(results)
+        for sheet, df in sheets.items():
+            accumulators.setdefault(sheet, ColumnarAppender()).append(df)
+    results.close()
+
+    if cache is not None:
+        cache.prune(files)
+        cache.save()
+    return {sheet: appender.finish() for sheet, appender in accumulators.items()}
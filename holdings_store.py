@@ -0,0 +1,105 @@
+import os
+import shutil
+
+import pandas as pd
+
+DATE_COLS = ["date", "earliest_date", "prev_date", "cons_filing_date"]
+KEY_COLS = ["ISIN", "InvestorType"]
+
+
+class HoldingsStore:
+    """
+    Canonical store of year-end SharesHeld snapshots: a Parquet dataset partitioned by year
+    (root/year=YYYY/part-0.parquet).
+      - A partition is staged in root/_tmp (which Parquet readers skip) and then moved into
+        place, so a crashed write never leaves a half-written year= folder.
+      - ISIN and InvestorType are written as dictionary-encoded (categorical) columns and
+        the holdings dates as datetime64, so readers can push down ISIN and year filters.
+      - Numeric values are written as float64 / int64 in every partition, so all years
+        share one schema.
+      - Stata files are a view generated from the store (see stata_view / by_type).
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # Partitions left half-staged by a crashed write (older runs staged in year=YYYY.tmp)
+        for name in os.listdir(root):
+            if name == "_tmp" or (name.startswith("year=") and name.endswith(".tmp")):
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    def _year_dir(self, year):
+        return os.path.join(self.root, f"year={int(year)}")
+
+    def years(self):
+        years = []
+        for name in os.listdir(self.root):
+            value = name.split("=", 1)[1] if name.startswith("year=") else ""
+            # Skip anything that is not a finished year partition (e.g. an old year=YYYY.tmp)
+            if value.isdigit() and os.listdir(os.path.join(self.root, name)):
+                years.append(int(value))
+        return sorted(years)
+
+    def has_year(self, year):
+        return int(year) in self.years()
+
+    def write_year(self, year, snapshot):
+        """Replace the partition for `year` with `snapshot` (staged in root/_tmp first)."""
+        out = snapshot.drop(columns=["year"], errors="ignore")
+        for c in KEY_COLS:
+            if c in out.columns:
+                out[c] = out[c].astype("category")
+        for c in DATE_COLS:
+            if c in out.columns and not pd.api.types.is_datetime64_any_dtype(out[c]):
+                out[c] = pd.to_datetime(out[c], errors="coerce")
+        # Values are stored at full width whatever compact_frame chose for this year, as a
+        # multi-year read casts every partition to the schema of the first one
+        for c in out.columns:
+            if pd.api.types.is_float_dtype(out[c]):
+                out[c] = out[c].astype("float64")
+            elif pd.api.types.is_integer_dtype(out[c]) and not pd.api.types.is_bool_dtype(out[c]):
+                out[c] = out[c].astype("int64")
+
+        final_dir = self._year_dir(year)
+        tmp_dir = os.path.join(self.root, "_tmp", os.path.basename(final_dir))
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        out.to_parquet(os.path.join(tmp_dir, "part-0.parquet"), index=False)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+
+    def read(self, years=None, isins=None, columns=None):
+        """Read holdings for the given years and ISINs (all if None); filters are pushed down to Parquet."""
+        years = self.years() if years is None else [int(y) for y in years]
+        if not years:
+            return pd.DataFrame()
+        filters = [("year", "in", years)]
+        if isins is not None:
+            filters.append(("ISIN", "in", list(isins)))
+        if columns is not None and "year" not in columns:
+            columns = list(columns) + ["year"]
+        df = pd.read_parquet(self.root, filters=filters, columns=columns)
+        df["year"] = df["year"].astype("int16")
+        return df
+
+    def by_type(self, years=None, isins=None):
+        """SharesHeld summed by ISIN and InvestorType, one year partition at a time."""
+        parts = []
+        for year in (self.years() if years is None else years):
+            snap = self.read([year], isins, columns=["ISIN", "InvestorType", "SharesHeld"])
+            if snap.empty:
+                continue
+            parts.append(snap.groupby(["year", "ISIN", "InvestorType"], as_index=False, observed=True)["SharesHeld"].sum())
+        return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+
+    def stata_view(self, year):
+        """Snapshot and by-type frames for `year` laid out as the SharesHeld{year}.dta files."""
+        snapshot = self.read([year]).drop(columns=["year"])
+        by_type = (self.by_type([year]).drop(columns=["year"])
+                   .rename(columns={"SharesHeld": f"SharesHeld_{year}_AsOf"}))
+        # Stata would turn categoricals into value labels; keep ISIN / InvestorType as strings
+        for df in (snapshot, by_type):
+            for c in KEY_COLS:
+                if c in df.columns:
+                    df[c] = df[c].astype(str)
+        return snapshot, by_type
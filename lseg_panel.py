@@ -0,0 +1,243 @@
+import json
+import os
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from orbis_panel import check_duplicates
+
+BLOCK_ROWS = 10_000
+
+
+class LayoutError(ValueError):
+    """A sheet without the LSEG layout (header rows, year columns, data rows); batch mode skips it."""
+
+
+# Function to build the balanced ISIN x Year panel straight from the wide block of year columns
+def balanced_panel(data, isin_col, meta_cols, year_cols, years, value_name='Value', duplicates='first'):
+    """
+    Return one row per (ISIN, year in `years`), sorted by ISIN and Year, with the metadata
+    columns and `value_name` (float, NaN where the sheet has no value).
+      - The values matrix is reindexed to `years` and raveled row by row, so no grid is
+        built and nothing is merged; metadata is attached by repeating each ISIN's row.
+      - Every column labelled with one of `year_cols` is used, so a year may appear in two
+        columns. An ISIN on several rows, or a repeated year column, raises a ValueError
+        with duplicates='raise'; otherwise values are combined with 'first', 'last' or
+        'mean' (NaNs skipped) and metadata is the first non-missing value per ISIN.
+    """
+    isins = data[isin_col].astype('string').str.strip()
+    keep = (isins.notna() & (isins != '')).to_numpy()
+    isins = isins[keep].to_numpy(dtype=object)
+    meta = data.loc[keep, list(meta_cols)].reset_index(drop=True)
+    # Year columns are taken by position, since two columns may carry the same year label
+    positions = np.flatnonzero(data.columns.isin(list(year_cols)))
+    values = (data.iloc[keep, positions].set_axis(range(len(positions)), axis=1)
+              .apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64'))
+
+    # Two columns for the same year
+    year_labels = pd.Index([int(y) for y in data.columns[positions]])
+    if year_labels.has_duplicates:
+        check_duplicates(duplicates, f"{year_labels.duplicated().sum():,} year columns repeat a year")
+        combined = pd.DataFrame(values.T).groupby(year_labels.to_numpy(), sort=True).agg(duplicates)
+        values, year_labels = combined.to_numpy(dtype='float64').T, pd.Index(combined.index)
+
+    # ISINs on more than one row (e.g. several RICs for the same ISIN)
+    repeated = pd.Series(isins).duplicated(keep=False).to_numpy()
+    if repeated.any():
+        check_duplicates(duplicates, f"{len(set(isins[repeated])):,} ISINs appear on more than one row, e.g. {isins[repeated][0]}")
+        values = pd.DataFrame(values).groupby(isins, sort=False).agg(duplicates).to_numpy(dtype='float64')
+        meta = meta.groupby(isins, sort=False).first().reset_index(drop=True)
+        isins = pd.unique(isins)
+
+    order = np.argsort(isins, kind='stable')
+    isins, meta, values = isins[order], meta.iloc[order].reset_index(drop=True), values[order]
+
+    # Dense (ISIN, year) block: missing years become NaN columns, extra years are dropped
+    block = pd.DataFrame(values, columns=year_labels).reindex(columns=list(years)).to_numpy(dtype='float64')
+
+    n, n_years = len(isins), len(years)
+    rows = np.repeat(np.arange(n), n_years)
+    panel = {isin_col: pd.Categorical.from_codes(rows, isins),
+             'Year': np.tile(np.asarray(years, dtype='int16'), n)}
+    for c in meta.columns:
+        codes, labels = pd.factorize(meta[c])
+        panel[c] = pd.Categorical.from_codes(codes[rows], labels)
+    panel[value_name] = block.ravel()
+    return pd.DataFrame(panel)
+
+
+# Function to normalise a header cell: newlines and repeated spaces collapsed, None/NaN -> ""
+def clean_col_label(x) -> str:
+    if x is None or (isinstance(x, float) and pd.isna(x)):
+        return ""
+    return " ".join(str(x).replace("\n", " ").strip().split())
+
+
+def is_int_year(x, year_min, year_max) -> bool:
+    try:
+        y = int(str(x).strip())
+        return year_min <= y <= year_max
+    except Exception:
+        return False
+
+
+# Function to locate the metadata and year columns from the three header rows of an LSEG sheet
+def detect_header(header_rows, year_min, year_max):
+    """
+    LSEG layout: row 0 holds the metadata headers and "year" over every time-series column,
+    row 1 is mostly blank and row 2 holds the actual years; data starts on row 3.
+    Returns {"meta_idx", "meta_names", "year_idx", "year_labels"} (column positions and labels).
+    """
+    if header_rows.shape[0] < 3:
+        raise LayoutError("The sheet looks too short; expected 3 header rows.")
+    row0 = header_rows.iloc[0].tolist()
+    row2 = header_rows.iloc[2].tolist()
+
+    header = {"meta_idx": [], "meta_names": [], "year_idx": [], "year_labels": []}
+    for j, top in enumerate(row0):
+        if isinstance(top, str) and top.strip().lower() == "year":
+            # Year columns: top header == 'year' and row 2 has a valid year in range
+            if is_int_year(row2[j], year_min, year_max):
+                header["year_idx"].append(j)
+                header["year_labels"].append(int(str(row2[j]).strip()))
+        else:
+            # Metadata columns: anything not 'year' (non-empty)
+            name = clean_col_label(top)
+            if name:
+                header["meta_idx"].append(j)
+                header["meta_names"].append(name)
+
+    if not header["year_idx"]:
+        raise LayoutError(f"No valid year columns ({year_min}–{year_max}) were found. Check the header layout.")
+    return header
+
+
+class HeaderCache:
+    """
+    Detected headers per (workbook, sheet), kept in a JSON file. An entry is reused while
+    the workbook's size and modification time and the (year_min, year_max) span it was
+    detected with are unchanged, since the year columns depend on that span.
+    """
+
+    def __init__(self, path, year_min, year_max):
+        self.path = path
+        self.years = [year_min, year_max]
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as fh:
+                self.entries = json.load(fh)
+
+    @staticmethod
+    def _key(file, sheet):
+        return f"{os.path.abspath(file)}::{sheet}"
+
+    def _stamp(self, file):
+        st = os.stat(file)
+        return [st.st_size, st.st_mtime_ns] + self.years
+
+    def get(self, file, sheet):
+        entry = self.entries.get(self._key(file, sheet))
+        if entry and entry["stamp"] == self._stamp(file):
+            return entry["header"]
+        return None
+
+    def put(self, file, sheet, header):
+        self.entries[self._key(file, sheet)] = {"stamp": self._stamp(file), "header": header}
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(self.entries, fh)
+        os.replace(tmp, self.path)
+
+
+# Function to convert one block of raw year cells into float64 (text and blanks become NaN)
+def _float_block(block):
+    try:
+        return np.array(block, dtype='float64')
+    except (TypeError, ValueError):
+        return pd.DataFrame(block, dtype=object).apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64')
+
+
+# Function to read an LSEG sheet in two phases: header rows first, then only the needed columns
+def read_wide_sheet(path, sheet, year_min, year_max, header=None, block_rows=BLOCK_ROWS):
+    """
+    Return (data, header): `data` has one column per metadata name and one per integer year,
+    from row 3 down. Pass a cached `header` to skip detection.
+      - The workbook is opened read-only and rows are streamed: the first three rows
+        resolve the header, then only the metadata and year cells of each data row are kept.
+      - Year cells go straight into float64 blocks of `block_rows` rows (text -> NaN), so
+        the full sheet is never materialised as objects.
+      - A sheet with fewer than 3 header rows, or with no data row, raises a LayoutError.
+    """
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet].iter_rows(values_only=True)
+        top = [next(rows, None) for _ in range(3)]
+        if header is None:
+            top = [r for r in top if r is not None]
+            width = max((len(r) for r in top), default=0)
+            header_rows = pd.DataFrame([list(r) + [None] * (width - len(r)) for r in top])
+            header = detect_header(header_rows, year_min, year_max)
+
+        meta_idx, year_idx = header["meta_idx"], header["year_idx"]
+        width = max(meta_idx + year_idx) + 1
+        meta = [[] for _ in meta_idx]
+        blocks, block = [], []
+        for row in rows:
+            if len(row) < width:
+                row = tuple(row) + (None,) * (width - len(row))
+            for values, j in zip(meta, meta_idx):
+                values.append(row[j])
+            block.append([row[j] for j in year_idx])
+            if len(block) == block_rows:
+                blocks.append(_float_block(block))
+                block = []
+        if block:
+            blocks.append(_float_block(block))
+    finally:
+        wb.close()
+
+    if not blocks:
+        raise LayoutError("The sheet looks too short; expected at least 4 rows (3 header rows + data).")
+    years = np.vstack(blocks)
+    data = pd.DataFrame({name: pd.Series(values)
+                         for name, values in zip(header["meta_names"], meta)})
+    data = pd.concat([data, pd.DataFrame(years, columns=header["year_labels"])], axis=1)
+    return data, header
+
+
+# Function to join single-metric panels (one per region and metric) into one wide ISIN x Year panel
+def join_metrics(panels, isin_col='ISIN', duplicates='first'):
+    """
+    `panels` is a list of (metric, panel, meta_cols) as returned for each sheet. Regions of
+    the same metric are stacked, then every metric becomes one column of the result, which
+    has one row per (ISIN, Year) of any input, sorted by ISIN and Year.
+      - An ISIN present for one metric only gets NaN for the others.
+      - An (ISIN, Year) found in two sheets of the same metric is handled with `duplicates`.
+      - Metadata is the first non-missing value per ISIN across all sheets.
+    Returns (wide panel, metadata columns, metric columns).
+    """
+    by_metric, metas, meta_cols = {}, [], []
+    for metric, panel, cols in panels:
+        by_metric.setdefault(metric, []).append(panel)
+        metas.append(panel[[isin_col] + list(cols)].drop_duplicates(isin_col).astype({isin_col: str}))
+        meta_cols += [c for c in cols if c not in meta_cols]
+
+    columns = []
+    for metric, parts in by_metric.items():
+        stacked = pd.concat([p[[isin_col, 'Year', metric]].astype({isin_col: str}) for p in parts], ignore_index=True)
+        values = stacked.set_index([isin_col, 'Year'])[metric]
+        if values.index.has_duplicates:
+            check_duplicates(duplicates, f"{metric}: {values.index.duplicated().sum():,} ISIN-Year rows appear in more than one sheet")
+            values = values.groupby(level=[0, 1], sort=False).agg(duplicates)
+        columns.append(values)
+
+    wide = pd.concat(columns, axis=1).sort_index()
+    meta = pd.concat(metas, ignore_index=True).groupby(isin_col, sort=False)[meta_cols].first()
+    # Metadata follows the panel rows by position: each ISIN's row is repeated over its years
+    keys = wide.index.get_level_values(0)
+    out = pd.DataFrame({isin_col: keys, 'Year': wide.index.get_level_values(1).astype('int16')})
+    out = pd.concat([out, meta.reindex(keys).reset_index(drop=True), wide.reset_index(drop=True)], axis=1)
+    return out, meta_cols, list(by_metric)
@@ -0,0 +1,166 @@
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from excel_ingest import ColumnarAppender
+
+# Orbis value columns are labelled "Variable\nCurrency Year", e.g. "Total assets\nth USD 2020"
+HEADER_RE = re.compile(r'(.+)\n(.+)\s(.+)$')
+# read_excel renames a repeated header "X" to "X.1", "X.2", ..., which turns the year "2020" into "2020.1"
+DEDUP_YEAR_RE = re.compile(r'(\d+)\.\d+$')
+ID_VARS = ['Company name Latin alphabet', 'Country', 'Country ISO code']
+DUPLICATE_POLICIES = ('raise', 'first', 'last', 'mean')
+
+
+# Function to parse each distinct column label once into (Variable, Currency, Year)
+def parse_header_schema(columns):
+    """
+    Return a frame indexed by column label with categorical Variable, Currency and Year.
+    Labels that do not follow the "Variable\\nCurrency Year" layout (the id columns,
+    Unnamed columns, ...) are left out, as they carry no panel values. A repeated header
+    renamed by read_excel ("...\\nth USD 2020.1") parses like the original, so
+    wide_to_panel sees it as a duplicate.
+    """
+    rows = {}
+    for label in dict.fromkeys(columns):
+        match = HEADER_RE.search(label) if isinstance(label, str) else None
+        if match:
+            year = match.group(3)
+            dedup = DEDUP_YEAR_RE.fullmatch(year)
+            if dedup:
+                year = dedup.group(1)
+            rows[label] = (match.group(1).replace('\n', ' '), match.group(2), year)
+    schema = pd.DataFrame.from_dict(rows, orient='index', columns=['Variable', 'Currency', 'Year'])
+    return schema.astype('category')
+
+
+# Function to stop on duplicates, or report the policy used to combine them
+def check_duplicates(policy, message):
+    if policy == 'raise':
+        raise ValueError(f"{message}; set duplicates (--duplicates / DUPLICATES in the scripts) "
+                         f"to 'first', 'last' or 'mean' to combine them.")
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"Unknown duplicates policy {policy!r}; expected one of {DUPLICATE_POLICIES}.")
+    print(f"{message}; combined with '{policy}'.")
+
+
+# Function to reshape the wide 'Results' sheet straight into the company-year panel
+def wide_to_panel(df, schema, id_vars=ID_VARS, unit='A Million', duplicates='raise'):
+    """
+    Move values from the wide block into a (company, Year, Currency) x Variable panel by
+    array indexing, without building a long frame.
+      - Rows match the old melt + pivot_table output: rows with a missing id and rows or
+        variables without any value are dropped, and the panel is sorted by id, Year, Currency.
+      - pivot_table silently averaged duplicates. Here a company repeated in several rows,
+        or two columns with the same (Variable, Currency, Year), raise a ValueError unless
+        duplicates is 'first', 'last' or 'mean' (NaNs are skipped when combining).
+    """
+    value_cols = [c for c in df.columns if c in schema.index]
+    parts = schema.loc[value_cols]
+
+    keep = df[id_vars].notna().all(axis=1).to_numpy()
+    keys = df.loc[keep, id_vars].reset_index(drop=True)
+    values = df.loc[keep, value_cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64')
+
+    # Companies that appear in more than one row (e.g. the same firm in two exports)
+    repeated = keys.duplicated(keep=False)
+    if repeated.any():
+        example = tuple(keys[repeated].iloc[0])
+        check_duplicates(duplicates, f"{keys[repeated].drop_duplicates().shape[0]:,} companies appear in more than one row, e.g. {example}")
+        grouped = pd.DataFrame(values).groupby([keys[c].to_numpy() for c in id_vars], sort=False).agg(duplicates)
+        keys = grouped.index.to_frame(index=False).set_axis(id_vars, axis=1)
+        values = grouped.to_numpy(dtype='float64')
+
+    # Position of every value column in the (Year, Currency) x Variable grid
+    years = parts['Year'].astype(str).to_numpy()
+    currencies = parts['Currency'].astype(str).to_numpy()
+    variables = parts['Variable'].astype(str).to_numpy()
+    groups = sorted(set(zip(years, currencies)))
+    names = sorted(set(variables))
+    if not groups or keys.empty:
+        return pd.DataFrame(columns=id_vars + ['Year', 'Currency', 'Unit'])
+    group_pos = {g: i for i, g in enumerate(groups)}
+    name_pos = {v: i for i, v in enumerate(names)}
+    cells = np.array([group_pos[g] * len(names) + name_pos[v] for g, v in zip(zip(years, currencies), variables)], dtype='int64')
+
+    unique_cells = np.unique(cells)
+    if len(unique_cells) < len(cells):
+        check_duplicates(duplicates, f"{len(cells) - len(unique_cells):,} columns repeat a (Variable, Currency, Year) header")
+        values = pd.DataFrame(values.T).groupby(cells).agg(duplicates).to_numpy(dtype='float64').T
+        cells = unique_cells
+
+    # Sort companies first; the grid groups are already sorted, so the panel comes out ordered
+    order = keys.sort_values(id_vars, kind='stable').index.to_numpy()
+    keys = keys.iloc[order].reset_index(drop=True)
+    values = values[order]
+
+    n, n_groups, n_names = len(keys), len(groups), len(names)
+    cube = np.full((n, n_groups, n_names), np.nan)
+    cube[:, cells // n_names, cells % n_names] = values
+    cube = cube.reshape(n * n_groups, n_names)
+
+    rows = np.flatnonzero(~np.isnan(cube).all(axis=1))
+    data = cube[rows]
+    del cube
+    # Repeated labels are built as categoricals (codes + one copy of each label), not as
+    # one string object per panel row
+    panel = {}
+    for c in id_vars:
+        codes, labels = pd.factorize(keys[c])
+        panel[c] = pd.Categorical.from_codes(codes[rows // n_groups], labels)
+    for i, c in enumerate(['Year', 'Currency']):
+        labels = sorted({g[i] for g in groups})
+        codes = np.array([labels.index(g[i]) for g in groups])
+        panel[c] = pd.Categorical.from_codes(codes[rows % n_groups], labels)
+    panel['Unit'] = pd.Categorical.from_codes(np.zeros(len(rows), dtype='int8'), [unit])
+    panel = pd.DataFrame(panel)
+
+    has_values = ~np.isnan(data).all(axis=0)
+    values_frame = pd.DataFrame(data[:, has_values], columns=[v for v, ok in zip(names, has_values) if ok])
+    return pd.concat([panel, values_frame], axis=1)
+
+
+# Function to remove the bucket folders of a spill (other files are kept), and the folder once empty
+def clear_spill(spill_dir):
+    if os.path.isdir(spill_dir):
+        for name in os.listdir(spill_dir):
+            if name.startswith('bucket='):
+                shutil.rmtree(os.path.join(spill_dir, name))
+        if not os.listdir(spill_dir):
+            os.rmdir(spill_dir)
+
+
+# Function to spill one parsed 'Results' sheet to a typed Parquet dataset, bucketed by company
+def spill_results(df, spill_dir, part_name, n_buckets=16, id_vars=ID_VARS):
+    """
+    Write `df` as spill_dir/bucket=NNN/<part_name>.parquet. Rows are bucketed by a stable
+    hash of the company id, so every row of a company lands in the same bucket whatever
+    file it came from, and each bucket can be reshaped (and checked for duplicates) on its own.
+    Ids are stored as strings and value columns as float64; other columns are dropped.
+    """
+    schema = parse_header_schema(df.columns)
+    value_cols = [c for c in df.columns if c in schema.index]
+    typed = df[id_vars].astype('string')
+    typed = pd.concat([typed, df[value_cols].apply(pd.to_numeric, errors='coerce').astype('float64')], axis=1)
+
+    buckets = (pd.util.hash_pandas_object(typed[id_vars], index=False) % n_buckets).to_numpy()
+    for bucket in np.unique(buckets):
+        bucket_dir = os.path.join(spill_dir, f'bucket={bucket:03d}')
+        os.makedirs(bucket_dir, exist_ok=True)
+        typed[buckets == bucket].to_parquet(os.path.join(bucket_dir, f'{part_name}.parquet'), index=False)
+
+
+# Function to reshape the spilled dataset one bucket at a time
+def iter_spilled_panels(spill_dir, id_vars=ID_VARS, unit='A Million', duplicates='raise'):
+    """Yield one panel per bucket; peak memory is bounded by the largest bucket, not the full dataset."""
+    buckets = sorted(name for name in os.listdir(spill_dir) if name.startswith('bucket='))
+    for bucket in buckets:
+        bucket_dir = os.path.join(spill_dir, bucket)
+        appender = ColumnarAppender()
+        for part in sorted(os.listdir(bucket_dir)):
+            appender.append(pd.read_parquet(os.path.join(bucket_dir, part)))
+        results = appender.finish()
+        yield wide_to_panel(results, parse_header_schema(results.columns), id_vars, unit, duplicates)
@@ -0,0 +1,196 @@
+import csv
+import os
+import re
+
+import xlsxwriter
+
+from stata_export import iter_chunks, write_stata_parts
+
+FORMATS = ('xlsx', 'csv', 'parquet', 'dta')
+CHUNK_ROWS = 100_000
+EXCEL_MAX_ROWS = 1_048_576  # rows per worksheet, header row included
+EXCEL_MAX_NAME = 31
+
+
+# Function to show missing values of `na_cols` as `na_rep`, one chunk of a text output at a time
+def _fill_missing(chunk, na_cols, na_rep):
+    cols = [c for c in chunk.columns if c in na_cols and chunk[c].isna().any()]
+    if not na_rep or not cols:
+        return chunk
+    chunk = chunk.copy()
+    for c in cols:
+        chunk[c] = chunk[c].astype(object).where(chunk[c].notna(), na_rep)
+    return chunk
+
+
+# Function to turn a chunk into rows of plain Python values for xlsxwriter (None = blank cell)
+def _cell_rows(chunk, na_cols, na_rep):
+    columns = []
+    for c in chunk.columns:
+        s = chunk[c]
+        values = s.tolist()
+        missing = s.isna().to_numpy()
+        if missing.any():
+            fill = na_rep if na_rep and c in na_cols else None
+            values = [fill if m else v for v, m in zip(values, missing)]
+        columns.append(values)
+    return zip(*columns)
+
+
+# Function to make a valid worksheet name, with room for a continuation suffix
+def _sheet_name(name, suffix=''):
+    name = re.sub(r'[\[\]:*?/\\]', '_', str(name)) or 'Sheet'
+    return name[:EXCEL_MAX_NAME - len(suffix)] + suffix
+
+
+class TableWriter:
+    """
+    Write one or more named tables to `path`; the extension picks the format.
+      - .xlsx: one worksheet per table, streamed row by row with xlsxwriter in
+        constant_memory mode. A table longer than Excel's 1,048,576 rows continues on
+        "<name>_2", "<name>_3", ... (each with the header row).
+      - .csv / .parquet: one file per table (<base>_<name>.<ext>, or `path` itself for
+        the unnamed table), appended chunk by chunk.
+      - .dta: one write() per table, as a single file unless `stata_rows` is set; then
+        tables longer than that are split into numbered parts by stata_export.
+    Calling write() again with the same name appends to that table (not for .dta).
+    Missing values: na_rep in the na_cols of .xlsx / .csv output, nulls in Parquet and
+    Stata missing in .dta. close() writes <base>_manifest.csv when a table was split.
+    """
+
+    def __init__(self, path, na_rep='', chunk_rows=CHUNK_ROWS, max_rows=EXCEL_MAX_ROWS, stata_rows=None,
+                 **stata_kwargs):
+        self.path = path
+        self.base, ext = os.path.splitext(path)
+        self.format = ext.lower().lstrip('.')
+        if self.format not in FORMATS:
+            raise ValueError(f"Unsupported output format {ext!r}; expected one of {FORMATS}.")
+        self.na_rep = na_rep
+        self.chunk_rows = chunk_rows
+        self.max_rows = max_rows
+        self.stata_rows = stata_rows
+        self.stata_kwargs = stata_kwargs
+        self.workbook = None
+        if self.format == 'xlsx':
+            self.workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True,
+                                                       'default_date_format': 'yyyy-mm-dd',
+                                                       'remove_timezone': True})
+        self.tables = {}
+        self.manifest = []
+
+    def _path_for(self, name):
+        return self.path if name is None else f"{self.base}_{name}.{self.format}"
+
+    def _new_part(self, name, location):
+        part = {'table': name or '', 'part': sum(p['table'] == (name or '') for p in self.manifest) + 1,
+                'location': location, 'rows': 0}
+        self.manifest.append(part)
+        return part
+
+    def _new_sheet(self, name, state):
+        suffix = '' if state['part'] is None else f"_{state['part']['part'] + 1}"
+        sheet_name = _sheet_name(name or 'Sheet1', suffix)
+        if suffix:
+            print(f"Sheet '{state['part']['location']}' is full ({self.max_rows - 1:,} rows), continuing on '{sheet_name}'")
+        state['sheet'] = self.workbook.add_worksheet(sheet_name)
+        state['sheet'].write_row(0, 0, state['header'])
+        state['row'] = 1
+        state['part'] = self._new_part(name, sheet_name)
+
+    def _write_xlsx(self, df, name, na_cols):
+        state = self.tables.get(name)
+        if state is None:
+            state = self.tables[name] = {'header': [str(c) for c in df.columns], 'part': None}
+            self._new_sheet(name, state)
+        for _lo, _hi, chunk in iter_chunks(df, self.chunk_rows):
+            for values in _cell_rows(chunk, na_cols, self.na_rep):
+                if state['row'] >= self.max_rows:
+                    self._new_sheet(name, state)
+                state['sheet'].write_row(state['row'], 0, values)
+                state['row'] += 1
+                state['part']['rows'] += 1
+
+    def _write_csv(self, df, name, na_cols):
+        first = name not in self.tables
+        if first:
+            self.tables[name] = {'part': self._new_part(name, os.path.basename(self._path_for(name)))}
+        state = self.tables[name]
+        chunks = iter_chunks(df, self.chunk_rows) if len(df) else [(0, 0, df)]
+        for lo, _hi, chunk in chunks:
+            _fill_missing(chunk, na_cols, self.na_rep).to_csv(self._path_for(name), mode='w' if first and lo == 0 else 'a',
+                                                               header=first and lo == 0, index=False)
+        state['part']['rows'] += len(df)
+
+    def _write_parquet(self, df, name):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        state = self.tables.get(name)
+        if state is None:
+            state = self.tables[name] = {'writer': pq.ParquetWriter(self._path_for(name), table.schema),
+                                         'part': self._new_part(name, os.path.basename(self._path_for(name)))}
+        state['writer'].write_table(table, row_group_size=self.chunk_rows)
+        state['part']['rows'] += len(df)
+
+    def _write_dta(self, df, name):
+        if name in self.tables:
+            raise ValueError(f"Table {name!r} was already written; .dta tables are written in one call.")
+        self.tables[name] = {}
+        # chunk_rows is only the streaming step of the text formats; Stata parts have their own size
+        part_rows = self.stata_rows or max(len(df), 1)
+        for part in write_stata_parts(df, os.path.splitext(self._path_for(name))[0], part_rows, **self.stata_kwargs):
+            self._new_part(name, part['file'])['rows'] = part['rows']
+
+    def write(self, df, name=None, na_cols=None):
+        """Write (or append) `df` as table `name`; na_cols defaults to every column."""
+        na_cols = set(df.columns if na_cols is None else na_cols)
+        if self.format == 'xlsx':
+            self._write_xlsx(df, name, na_cols)
+        elif self.format == 'csv':
+            self._write_csv(df, name, na_cols)
+        elif self.format == 'parquet':
+            self._write_parquet(df, name)
+        else:
+            self._write_dta(df, name)
+
+    def files(self):
+        """Paths of the files written so far."""
+        if self.format == 'xlsx':
+            return [self.path]
+        if self.format == 'dta':
+            return [os.path.join(os.path.dirname(self.path), p['location']) for p in self.manifest]
+        return [self._path_for(name) for name in self.tables]
+
+    def close(self):
+        """Finish every file; list the parts in <base>_manifest.csv if any table was split."""
+        if self.workbook is not None:
+            self.workbook.close()
+        for state in self.tables.values():
+            if 'writer' in state:
+                state['writer'].close()
+        tables = [p['table'] for p in self.manifest]
+        if len(set(tables)) < len(tables):
+            with open(self.base + '_manifest.csv', 'w', newline='', encoding='utf-8') as fh:
+                writer = csv.DictWriter(fh, fieldnames=['table', 'part', 'location', 'rows'])
+                writer.writeheader()
+                writer.writerows(self.manifest)
+        return self.manifest
+
+
+# Function to write a single table in the format given by the file extension
+def write_table(df, path, na_rep='', na_cols=None, chunk_rows=CHUNK_ROWS, **kwargs):
+    """
+    Write `df` (values kept as floats with NaN) to .xlsx, .csv, .parquet or .dta.
+    The missing-value convention belongs to the writer, not to the data:
+      - .xlsx / .csv: missing values in `na_cols` (default: all columns) are written as
+        `na_rep` (e.g. "."), chunk by chunk, so the frame itself is never boxed to objects;
+      - .parquet: nulls;
+      - .dta: Stata missing (.), via stata_export, as one file (stata_rows=N splits it
+        into parts of N rows).
+    See TableWriter for the streaming .xlsx writer and sheet spill.
+    """
+    writer = TableWriter(path, na_rep, chunk_rows, **kwargs)
+    writer.write(df, na_cols=na_cols)
+    writer.close()
+    return path
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+
+# Function to hash the contents of a file in blocks
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Function to write the parsed sheets of one workbook into the cache (safe to call from a worker)
+def write_entry(cache_dir, file, sheet_names, sheets):
+    """
+    Store each sheet as Parquet (pickle if the frame cannot be written as Parquet, e.g.
+    mixed-type object columns or pyarrow missing) and return the index entry for `file`.
+    `sheet_names` is the full list of sheets in the workbook, so absent sheets are known.
+    """
+    stat = os.stat(file)
+    stem = hashlib.sha1(os.path.abspath(file).encode('utf-8')).hexdigest()[:16]
+    stored = {}
+    for i, (sheet, df) in enumerate(sheets.items()):
+        base = os.path.join(cache_dir, f'{stem}_{i}')
+        try:
+            df.to_parquet(base + '.parquet', index=False)
+            stored[sheet] = os.path.basename(base + '.parquet')
+        except Exception:
+            if os.path.exists(base + '.parquet'):
+                os.remove(base + '.parquet')
+            df.to_pickle(base + '.pkl')
+            stored[sheet] = os.path.basename(base + '.pkl')
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_sha256(file),
+            'sheet_names': list(sheet_names), 'sheets': stored}
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed workbook sheets, keyed by file path.
+      - An entry is reused when size and mtime still match; if only the mtime changed,
+        the SHA-256 of the contents decides (e.g. a file copied over with the same data).
+      - Changed workbooks are evicted on lookup, deleted ones by prune().
+      - hits, misses and bytes_saved (size of workbooks served from cache) are counted per run.
+    """
+
+    INDEX_NAME = 'index.json'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index_path = os.path.join(cache_dir, self.INDEX_NAME)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as fh:
+                self.index = json.load(fh)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    @staticmethod
+    def _key(file):
+        return os.path.normcase(os.path.abspath(file))
+
+    def _evict(self, key):
+        entry = self.index.pop(key, None)
+        for name in (entry or {}).get('sheets', {}).values():
+            path = os.path.join(self.cache_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _is_current(self, file, entry):
+        stat = os.stat(file)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns != entry['mtime_ns']:
+            if file_sha256(file) != entry['sha256']:
+                return False
+            entry['mtime_ns'] = stat.st_mtime_ns  # touched but unchanged
+        return True
+
+    def lookup(self, file, sheet_names=None):
+        """Return {sheet_name: DataFrame} from the cache, or None (and evict) if `file` must be re-parsed."""
+        key = self._key(file)
+        entry = self.index.get(key)
+        if entry is not None and self._is_current(file, entry):
+            wanted = [s for s in entry['sheet_names'] if sheet_names is None or s in sheet_names]
+            if all(s in entry['sheets'] for s in wanted):
+                self.hits += 1
+                self.bytes_saved += entry['size']
+                return {s: self._load(entry['sheets'][s]) for s in wanted}
+        if entry is not None:
+            self._evict(key)
+        self.misses += 1
+        return None
+
+    def _load(self, name):
+        path = os.path.join(self.cache_dir, name)
+        return pd.read_parquet(path) if name.endswith('.parquet') else pd.read_pickle(path)
+
+    def record(self, file, entry):
+        self.index[self._key(file)] = entry
+
+    def prune(self, files):
+        """Evict entries for workbooks that are no longer in `files`."""
+        keep = {self._key(f) for f in files}
+        for key in [k for k in self.index if k not in keep]:
+            self._evict(key)
+
+    def save(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(self.index, fh, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def summary(self):
+        return (f"Parse cache: {self.hits} hits, {self.misses} misses, "
+                f"{self.bytes_saved / 1e6:,.1f} MB of workbooks not re-parsed")
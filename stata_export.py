@@ -0,0 +1,128 @@
+import csv
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import pandas as pd
+
+
+# Function to yield row ranges of a frame as views, without building every chunk up front
+def iter_chunks(df, chunk_rows):
+    for lo in range(0, len(df), chunk_rows):
+        hi = min(lo + chunk_rows, len(df))
+        yield lo, hi, df.iloc[lo:hi]
+
+
+# Function run inside a worker: convert dates for this chunk only and write it
+def _write_part(chunk, path, version, date_cols):
+    date_cols = [c for c in date_cols if c in chunk.columns]
+    to_convert = {c: pd.to_datetime(chunk[c], errors="coerce") for c in date_cols
+                  if not pd.api.types.is_datetime64_any_dtype(chunk[c])}
+    # Stata would store categoricals as value-labelled codes; write their values instead
+    to_convert.update({c: chunk[c].astype(object) for c in chunk.columns
+                       if isinstance(chunk[c].dtype, pd.CategoricalDtype)})
+    if to_convert:
+        chunk = chunk.assign(**to_convert)
+    chunk.to_stata(path, write_index=False, version=version,
+                   convert_dates={c: "td" for c in date_cols} or None)
+    return path
+
+
+class StataPartWriter:
+    """
+    Write one or more frames as numbered .dta parts of at most `chunk_rows` rows.
+      - Chunks are row slices taken from a generator, and date columns are converted per
+        chunk, so the full frame is never copied.
+      - workers > 1 writes parts in a process pool (at most 2 * workers parts in flight).
+      - close() writes <base>_manifest.csv (file and row range of every part) and
+        <base>_append.do, which rebuilds the full dataset in Stata with `append`.
+      - Frames smaller than a part (e.g. one company bucket each) are held back and written
+        together, so every part but the last has chunk_rows rows; close() writes the rest.
+        If every frame written was empty, close() writes one zero-row part with their
+        columns, so an empty table still produces a .dta file.
+    part_format gets `base` (path without extension) and `i` (1-based part number).
+    """
+
+    def __init__(self, base_no_ext, chunk_rows, part_format="{base}_part{i:02d}.dta",
+                 version=114, date_cols=(), workers=1):
+        self.base_no_ext = base_no_ext
+        self.chunk_rows = chunk_rows
+        self.part_format = part_format
+        self.version = version
+        self.date_cols = list(date_cols)
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.window = 2 * workers if self.pool is not None else 1
+        self.pending = deque()
+        self.manifest = []
+        self.n_rows = 0
+        self.buffer = []
+        self.buffered = 0
+
+    def _submit(self, chunk, path):
+        if self.pool is not None:
+            return self.pool.submit(_write_part, chunk, path, self.version, self.date_cols)
+        future = Future()
+        future.set_result(_write_part(chunk, path, self.version, self.date_cols))
+        return future
+
+    def _drain(self, keep):
+        while len(self.pending) > keep:
+            self.pending.popleft().result()
+
+    def _add_part(self, chunk):
+        path = self.part_format.format(base=self.base_no_ext, i=len(self.manifest) + 1)
+        self._drain(self.window - 1)
+        self.pending.append(self._submit(chunk, path))
+        self.manifest.append({"part": len(self.manifest) + 1, "file": os.path.basename(path),
+                              "first_row": self.n_rows, "last_row": self.n_rows + len(chunk) - 1,
+                              "rows": len(chunk)})
+        print(f"OK → {path}  [{self.n_rows:,}:{self.n_rows + len(chunk):,}]")
+        self.n_rows += len(chunk)
+
+    # Function to write the buffered frames as full parts; the short tail waits unless final
+    def _flush(self, final):
+        df = self.buffer[0] if len(self.buffer) == 1 else pd.concat(self.buffer, ignore_index=True)
+        self.buffer, self.buffered = [], 0
+        for lo, hi, chunk in iter_chunks(df, self.chunk_rows):
+            if hi - lo < self.chunk_rows and not final:
+                self.buffer, self.buffered = [chunk], hi - lo
+                return
+            self._add_part(chunk)
+        if final and not self.manifest:
+            self._add_part(df)
+
+    def write(self, df):
+        self.buffer.append(df)
+        self.buffered += len(df)
+        if self.buffered >= self.chunk_rows:
+            self._flush(final=False)
+
+    def close(self):
+        """Wait for every part, then write the manifest and the Stata append script."""
+        if self.buffer:
+            self._flush(final=True)
+        self._drain(0)
+        if self.pool is not None:
+            self.pool.shutdown()
+        if len(self.manifest) > 1:
+            with open(self.base_no_ext + "_manifest.csv", "w", newline="", encoding="utf-8") as fh:
+                writer = csv.DictWriter(fh, fieldnames=["part", "file", "first_row", "last_row", "rows"])
+                writer.writeheader()
+                writer.writerows(self.manifest)
+            with open(self.base_no_ext + "_append.do", "w", encoding="utf-8") as fh:
+                fh.write(f"* Rebuild {os.path.basename(self.base_no_ext)} from its {len(self.manifest)} parts "
+                         f"({self.n_rows:,} rows); run from the folder holding the parts\n")
+                fh.write(f'use "{self.manifest[0]["file"]}", clear\n')
+                for part in self.manifest[1:]:
+                    fh.write(f'append using "{part["file"]}"\n')
+        return self.manifest
+
+
+# Function to write a frame as base.dta, or as numbered parts when it exceeds chunk_rows
+def write_stata_parts(df, base_no_ext, chunk_rows, part_format="{base}_part{i:02d}.dta",
+                      single_file=True, **kwargs):
+    if single_file and len(df) <= chunk_rows:
+        part_format = "{base}.dta"
+    writer = StataPartWriter(base_no_ext, chunk_rows, part_format, **kwargs)
+    writer.write(df)
+    return writer.close()
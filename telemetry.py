@@ -0,0 +1,315 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from tqdm import tqdm
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module
+    resource = None
+
+PROFILERS = ('cprofile', 'sample')
+
+
+def _proc_status_mb(field):
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak-RSS mark (Linux VmHWM); False where that is not possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak RSS of this process since the last reset (or since start), in MB; None where unknown."""
+    peak = _proc_status_mb('VmHWM')
+    if peak is not None or resource is None:
+        return peak
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2 ** 20 if sys.platform == 'darwin' else maxrss / 1024
+
+
+# Function to take the larger of two peaks, either of which may be unknown (None)
+def _max_peak(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+# Function to add up the sizes of the files that exist among `paths`
+def file_bytes(paths):
+    return sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+
+
+class SamplingProfiler:
+    """
+    Record the call stack of one thread every `interval` seconds from a background thread.
+    dump() writes the stacks in the collapsed "outer;inner count" format read by flame graph
+    tools (flamegraph.pl, speedscope); overhead stays low at the default 10 ms interval.
+    """
+
+    def __init__(self, thread_id=None, interval=0.01):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as fh:
+            for stack, count in self.counts.most_common():
+                fh.write(f"{stack} {count}\n")
+
+
+class Telemetry:
+    """
+    Structured measurements of a run, appended to `path` as JSON lines (one record per line).
+      - stage(name, **fields) times a block: wall and CPU seconds, CPU of finished child
+        processes (e.g. a --workers pool), peak RSS of this process during the block
+        (Linux: VmHWM, reset when a stage starts) and the rows / bytes the caller sets on the
+        yielded dict. An exception is recorded as status 'error' and raised again.
+      - event(kind, **fields) records anything else; request() is the EikonScheduler
+        on_request hook and progress() wraps a file iterable with one record per file.
+      - profile='cprofile' or 'sample' profiles the stages named in profile_stages (all if
+        empty) into <profile_dir>/<run>_<stage>_<n>.prof / .folded.
+    Every record carries the run id, the script name and the `context` fields; each stage is
+    also printed as a one-line summary. With path=None nothing is written to disk.
+    """
+
+    def __init__(self, path=None, script=None, context=None, profile=None, profile_stages=(),
+                 profile_dir=None, echo=True):
+        if profile not in (None,) + PROFILERS:
+            raise ValueError(f"profile must be one of {PROFILERS}, not {profile!r}")
+        self.path = path
+        self.script = script or os.path.basename(sys.argv[0])
+        self.context = dict(context or {})
+        self.run = time.strftime('%Y%m%dT%H%M%S') + f"-{os.getpid()}"
+        self.profile = profile
+        self.profile_stages = set(profile_stages)
+        self.profile_dir = profile_dir or (os.path.dirname(os.path.abspath(path)) if path else os.getcwd())
+        self.echo = echo
+        self.stages = []
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self._active = []
+        self._profiled = Counter()
+        self._fh = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._fh = open(path, 'a', encoding='utf-8')
+        self.peak_scope = 'stage' if reset_peak_rss() else 'process'
+
+    def _emit(self, record):
+        record = {'ts': round(time.time(), 3), 'run': self.run, 'script': self.script, **self.context, **record}
+        if self._fh is not None:
+            line = json.dumps(record, default=str)
+            with self.lock:
+                self._fh.write(line + '\n')
+                self._fh.flush()  # keep what was measured if the run dies
+        return record
+
+    def event(self, kind, **fields):
+        return self._emit({'event': kind, **fields})
+
+    def _start_profiler(self, name):
+        if self.profile is None or (self.profile_stages and name not in self.profile_stages):
+            return None, None
+        self._profiled[name] += 1
+        stem = os.path.join(self.profile_dir, f"{self.run}_{name.replace(' ', '_')}_{self._profiled[name]}")
+        if self.profile == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler, stem + '.prof'
+        profiler = SamplingProfiler()
+        profiler.start()
+        return profiler, stem + '.folded'
+
+    @staticmethod
+    def _stop_profiler(profiler, path):
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            profiler.dump_stats(path)
+        else:
+            profiler.stop()
+            profiler.dump(path)
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """Measure the block as stage `name`; set info['rows'] / info['bytes'] inside it."""
+        info = {'rows': None, 'bytes': None}
+        # Enclosing stages keep their peak so far before the mark is reset for this one
+        current = peak_rss_mb()
+        for outer in self._active:
+            outer['peak'] = _max_peak(outer['peak'], current)
+        state = {'peak': None}
+        self._active.append(state)
+        if self.peak_scope == 'stage':
+            reset_peak_rss()
+        profiler, profile_path = self._start_profiler(name)
+        times = os.times()
+        wall, cpu = time.perf_counter(), time.process_time()
+        status, error = 'ok', None
+        try:
+            yield info
+        except BaseException as exc:
+            status, error = 'error', f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            seconds, cpu_seconds = time.perf_counter() - wall, time.process_time() - cpu
+            after = os.times()
+            if profiler is not None:
+                self._stop_profiler(profiler, profile_path)
+            self._active.pop()
+            state['peak'] = _max_peak(state['peak'], peak_rss_mb())
+            for outer in self._active:
+                outer['peak'] = _max_peak(outer['peak'], state['peak'])
+            # The call that ends a timed() iterator is not a stage
+            if not info.get('skip'):
+                rss = _proc_status_mb('VmRSS')
+                record = self.event('stage', stage=name, **fields, status=status, error=error,
+                                    seconds=round(seconds, 4), cpu_seconds=round(cpu_seconds, 4),
+                                    child_cpu_seconds=round(after.children_user + after.children_system
+                                                            - times.children_user - times.children_system, 4),
+                                    peak_rss_mb=None if state['peak'] is None else round(state['peak'], 1), peak_rss_scope=self.peak_scope,
+                                    rss_mb=None if rss is None else round(rss, 1),
+                                    rows=info['rows'], bytes=info['bytes'],
+                                    profile=profile_path if profiler is not None else None)
+                self.stages.append(record)
+                if self.echo:
+                    self._print_stage(record, fields)
+
+    @staticmethod
+    def _print_stage(r, fields):
+        labels = ' '.join(f"{k}={v}" for k, v in fields.items())
+        line = (f"[{r['stage']}{' ' + labels if labels else ''}] {r['seconds']:.2f} s wall, "
+                f"{r['cpu_seconds'] + r['child_cpu_seconds']:.2f} s CPU")
+        if r['peak_rss_mb'] is not None:
+            line += f", peak {r['peak_rss_mb']:,.0f} MB"
+        if r['rows'] is not None:
+            line += f", {r['rows']:,} rows"
+        if r['bytes'] is not None:
+            line += f", {r['bytes'] / 2 ** 20:,.1f} MB data"
+        if r['status'] != 'ok':
+            line += f" - {r['error']}"
+        print(line)
+
+    def timed(self, iterable, name, **fields):
+        """Yield from `iterable`, measuring the work behind each item as one `name` stage."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name, **fields) as info:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    info['skip'] = True
+                    return
+                info['rows'] = len(item) if hasattr(item, '__len__') else None
+            yield item
+
+    def progress(self, items, stage, desc=None):
+        """
+        Yield each of `items` (a list, e.g. workbook paths), recording after each one how many
+        are done, the seconds it took and the estimated time remaining; desc adds a tqdm bar.
+        """
+        total = len(items)
+        start = last = time.perf_counter()
+        for i, item in enumerate(tqdm(items, desc=desc) if desc else items):
+            yield item
+            now = time.perf_counter()
+            self.event('progress', stage=stage, item=str(item), done=i + 1, total=total,
+                       seconds=round(now - last, 4), elapsed=round(now - start, 2),
+                       eta_seconds=round((now - start) / (i + 1) * (total - i - 1), 1))
+            last = now
+
+    def request(self, isins, params, seconds, n_rows, err):
+        """EikonScheduler on_request hook: one 'request' record per ek.get_data call."""
+        with self.lock:
+            self.requests['requests'] += 1
+            self.requests['errors'] += bool(err)
+            self.requests['rows'] += n_rows
+            self.requests['seconds'] += seconds
+        self.event('request', isins=len(isins), params=params, seconds=round(seconds, 4), rows=n_rows,
+                   error=None if not err else str(err))
+
+    def summary(self):
+        """Totals per stage name (count, seconds, CPU seconds, largest peak RSS) and per request."""
+        totals = defaultdict(lambda: {'count': 0, 'seconds': 0.0, 'cpu_seconds': 0.0, 'peak_rss_mb': None})
+        for r in self.stages:
+            t = totals[r['stage']]
+            t['count'] += 1
+            t['seconds'] += r['seconds']
+            t['cpu_seconds'] += r['cpu_seconds'] + r['child_cpu_seconds']
+            t['peak_rss_mb'] = _max_peak(t['peak_rss_mb'], r['peak_rss_mb'])
+        return {'stages': {k: {m: round(v, 4) if isinstance(v, float) else v for m, v in t.items()}
+                           for k, t in totals.items()},
+                'requests': {k: round(v, 4) if isinstance(v, float) else v for k, v in self.requests.items()}}
+
+    def close(self):
+        """Write a 'summary' record, print the network totals and close the file."""
+        summary = self.summary()
+        self.event('summary', **summary)
+        if self.echo and self.requests['requests']:
+            r = self.requests
+            print(f"Network: {r['requests']:,} requests ({r['errors']:,} failed), {r['seconds']:,.1f} s "
+                  f"in requests, {r['rows']:,} rows")
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+            if self.echo:
+                print(f"Telemetry appended to {self.path}")
+        return summary
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Function to add the shared --telemetry / --profile options to a script's parser
+def add_arguments(parser, default_path=None):
+    parser.add_argument('--telemetry', default=default_path,
+                        help='JSON-lines file per-stage timings, memory and request records are appended to ("" for none)')
+    parser.add_argument('--profile', choices=PROFILERS, default=None,
+                        help='Profile stages with cProfile (.prof) or a sampling profiler (.folded stacks)')
+    parser.add_argument('--profile-stages', nargs='+', default=[], metavar='STAGE',
+                        help='Only profile these stages (default: all)')
+
+
+# Function to create the Telemetry of a script from the options added by add_arguments
+def from_args(args, script, **kwargs):
+    return Telemetry(args.telemetry or None, script=script, profile=args.profile,
+                     profile_stages=args.profile_stages, **kwargs)